@@ -1,41 +1,75 @@
 from __future__ import annotations
 
+import json
 import logging
 import os
 import time
+from functools import partial
+from typing import Callable, List
 
 import modules
-from fastapi import APIRouter, Request
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from modules import shared
-from modules.call_queue import wrap_gradio_gpu_call
-from PIL import Image, ImageOps
-from starlette.concurrency import iterate_in_threadpool
-
-from .config import LOGGER_NAME, NAME_SCRIPT_LOOPBACK, NAME_SCRIPT_UPSCALE
-from .script_hack import get_script_info, get_scripts_metadata, process_script_args
+from PIL import Image
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from .config import (
+    LOGGER_NAME,
+    NAME_SCRIPT_LOOPBACK,
+    NAME_SCRIPT_UPSCALE,
+    NAMES_PIL_UPSCALERS,
+    RAW_CONTENT_TYPE,
+    STREAM_CONTENT_TYPE,
+)
+from .coalesce import Coalescer
+from .jobs import JOB_FAILED, jobs
+from .metrics import metrics, stage
+from .pipeline import Pipeline, close_pipelines, create_img2img, create_txt2img
+from .progress import PREVIEW_FORMATS, stream_progress
+from .result_cache import result_cache
+from .script_hack import get_script_info, process_script_args, script_meta
 from .structs import (
+    BatchUpscaleRequest,
+    BatchUpscaleResponse,
     ConfigResponse,
+    DefaultImg2ImgOptions,
+    DefaultTxt2ImgOptions,
+    DefaultUpscaleOptions,
     ImageResponse,
     Img2ImgRequest,
+    JobResponse,
     Txt2ImgRequest,
     UpscaleRequest,
     UpscaleResponse,
 )
 from .utils import (
+    apply_mask,
     b64_to_img,
+    bytes_to_img,
     bytewise_xor,
+    encode_imgs,
     get_encrypt_key,
-    get_sampler_index,
+    get_etag,
+    get_mask_box,
+    get_offsets,
     get_upscaler_index,
     img_to_b64,
+    img_to_bytes,
     load_config,
+    map_parallel,
     merge_default_config,
-    parse_prompt,
+    pack_frame,
+    pack_parts,
+    parse_etags,
     prepare_backend,
     prepare_mask,
     save_img,
     sddebz_highres_fix,
+    trim_img,
+    unpack_parts,
+    upscale_tiled,
 )
 
 router = APIRouter()
@@ -66,24 +100,30 @@ log = logging.getLogger(LOGGER_NAME)
 #    - try and hijack more control (Pixel to expand per direction instead of all directions)
 #    - self-sketch mode: basically sketch + inpaint but the inpaint mask is auto-calculated
 #    - option to select poor man, mk 2 or self-sketch
-# TODO: Consider using pipeline directly instead of Gradio API for less surprises & better control
 
 
 @router.get("/config", response_model=ConfigResponse)
-async def get_state():
+async def get_state(req: Request):
     """Get information about backend API.
 
     Returns config from `krita_config.yaml`, other metadata,
     the path to the rendered image and image mask, etc.
 
+    The response has an `ETag` that changes whenever its contents do. If the
+    request's `If-None-Match` matches it, 304 is returned without a body.
+
+    While scripts are still being inspected after startup, only the "None"
+    script is listed instead of waiting for them. Script metadata is spliced in
+    as JSON precomputed by `script_meta`, as it is by far the largest part.
+
     Returns:
-        Dict: information.
+        Response: information as JSON.
     """
     opt = load_config().plugin
     prepare_backend(opt)
 
     sample_path = os.path.abspath(opt.sample_path)
-    return {
+    obj = {
         **opt.dict(),
         "sample_path": sample_path,
         "upscalers": [upscaler.name for upscaler in shared.sd_upscalers],
@@ -91,32 +131,188 @@ async def get_state():
         "samplers_img2img": [
             sampler.name for sampler in modules.sd_samplers.samplers_for_img2img
         ],
-        "scripts_txt2img": get_scripts_metadata(False),
-        "scripts_img2img": get_scripts_metadata(True),
         "face_restorers": [model.name() for model in shared.face_restorers],
         "sd_models": modules.sd_models.checkpoint_tiles(),  # yes internal API has spelling error
         "sd_vaes": ["None", "Automatic" ] + (list(modules.sd_vae.vae_dict))
     }
 
+    # key -> (JSON, digest)
+    scripts = {}
+    for key, is_img2img in [("scripts_txt2img", False), ("scripts_img2img", True)]:
+        result = script_meta.get(is_img2img, wait=False)
+        scripts[key] = ('{"None": []}', None) if result is None else result[1:]
+
+    etag = get_etag({**obj, **{k: digest for k, (_, digest) in scripts.items()}})
+    etags = parse_etags(req.headers.get("If-None-Match", ""))
+    if etag in etags or "*" in etags:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    body = json.dumps(obj)[:-1]
+    body += "".join(f', "{k}": {blob}' for k, (blob, _) in scripts.items()) + "}"
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+@router.get("/metrics")
+def f_metrics():
+    """Get timings of requests & their stages since startup.
+
+    Returns:
+        Response: Metrics in the Prometheus text format.
+    """
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/progress")
+async def f_progress(size: int = 0, format: str = "jpeg", quality: int = 80):
+    """Subscribe to progress of generation.
+
+    Progress is pushed as frames (see `progress.stream_progress`) only when it
+    changes, instead of clients polling `/sdapi/v1/progress`.
+
+    Args:
+        size (int, optional): Max width & height of live preview, 0 for full size. Defaults to 0.
+        format (str, optional): Format of live preview, jpeg or webp. Defaults to "jpeg".
+        quality (int, optional): Quality of live preview from 1 to 100. Defaults to 80.
+
+    Returns:
+        StreamingResponse: Stream of frames.
+    """
+    if format not in PREVIEW_FORMATS:
+        raise HTTPException(status_code=400, detail=f"unknown format: {format}")
+    return StreamingResponse(
+        stream_progress(max(size, 0), format, min(max(quality, 1), 100)),
+        media_type=STREAM_CONTENT_TYPE,
+    )
+
 
 @router.post("/txt2img", response_model=ImageResponse)
 def f_txt2img(req: Txt2ImgRequest):
     """Post request for Txt2Img.
 
+    If `checkpoint_cache` is set (in the request or config), it overrides the
+    webUI's own "Checkpoints to cache in RAM" setting.
+
     Args:
         req (Txt2ImgRequest): Request.
 
     Returns:
         Dict: Outputs and info.
     """
+    req = merge_default_config(req, load_config().txt2img)
+    images, info = run_cached(coalesce_txt2img, req)
+    with stage("encode"):
+        images = encode_imgs(images, req.output_format)
+
+    log.info(f"output sizes: {[len(i) for i in images]}")
+    log.info(f"finished txt2img!")
+    return {"outputs": images, "info": info}
+
+
+def parse_raw(body: bytes, model: type, **images: bool):
+    """Parse body of a binary transport route, decoding the images in it.
+
+    Malformed bodies are rejected with 422, same as FastAPI does for JSON bodies.
+
+    Args:
+        body (bytes): Body packed by `pack_parts`.
+        model (type): Model to parse the rest of the body as.
+        images (bool): Keys of images (or lists of images) in the body, and
+            whether each is required.
+
+    Raises:
+        HTTPException: Body is malformed.
+
+    Returns:
+        Tuple[BaseModel, Dict[str, Any]]: Request & images by key (None if missing).
+    """
+    try:
+        obj = unpack_parts(body)
+        decoded = {}
+        for key, required in images.items():
+            data = obj.pop(key, None)
+            if data is None and required:
+                raise ValueError(f"{key} is required")
+            if isinstance(data, list):
+                decoded[key] = [bytes_to_img(d) for d in data]
+            else:
+                decoded[key] = None if data is None else bytes_to_img(data)
+        return model.parse_obj(obj), decoded
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    except (ValueError, KeyError, TypeError, AttributeError, OSError) as e:
+        raise HTTPException(status_code=422, detail=f"invalid body: {e}")
+
+
+@router.post("/raw/txt2img")
+async def f_txt2img_raw(req: Request):
+    """Post request for Txt2Img with binary transport. See `pack_parts`.
+
+    Args:
+        req (Request): Request with packed `Txt2ImgRequest` as body.
+
+    Returns:
+        Response: Packed outputs (raw image bytes) and info.
+    """
+    opts, _ = parse_raw(await req.body(), Txt2ImgRequest)
+    opts = merge_default_config(opts, load_config().txt2img)
+    images, info = await run_in_threadpool(run_cached, coalesce_txt2img, opts)
+    with stage("encode"):
+        images = await run_in_threadpool(encode_imgs, images, opts.output_format, False)
+
+    log.info(f"output sizes: {[len(i) for i in images]}")
+    log.info(f"finished txt2img!")
+    return Response(
+        pack_parts({"outputs": images, "info": info}), media_type=RAW_CONTENT_TYPE
+    )
+
+
+@router.post("/stream/txt2img")
+async def f_txt2img_stream(req: Request):
+    """Post request for Txt2Img that streams outputs batch by batch as they are
+    generated. See `stream_batches`.
+
+    Args:
+        req (Request): Request with packed `Txt2ImgRequest` as body.
+
+    Returns:
+        StreamingResponse: Frames of packed outputs and info.
+    """
+    opts, _ = parse_raw(await req.body(), Txt2ImgRequest)
+    opts = merge_default_config(opts, load_config().txt2img)
+    reuse = {}
+    run = partial(run_cached, partial(run_txt2img, reuse=reuse))
+
+    def frames():
+        try:
+            yield from stream_batches(run, opts)
+        finally:
+            close_pipelines(reuse)
+
+    return StreamingResponse(frames(), media_type=STREAM_CONTENT_TYPE)
+
+
+def run_txt2img(req: DefaultTxt2ImgOptions, reuse: dict = None):
+    """Run Txt2Img.
+
+    Args:
+        req (DefaultTxt2ImgOptions): Request.
+        reuse (dict, optional): Holds the pipeline between calls for consecutive
+            batches of one request, see `f_txt2img_stream`. Defaults to None.
+
+    Returns:
+        Tuple[List[Image], str]: Output images and info.
+    """
     log.info(f"txt2img:\n{req}")
 
-    opt = load_config().txt2img
-    req = merge_default_config(req, opt)
-    prepare_backend(req)
+    with stage("config"):
+        opt = load_config().txt2img
+        req = merge_default_config(req, opt)
+    with stage("prepare"):
+        prepare_backend(req)
 
-    script_ind, script, meta = get_script_info(req.script, False)
-    args = process_script_args(script_ind, script, meta, req.script_args)
+    with stage("script_args"):
+        script_ind, script, opt_index = get_script_info(req.script, False)
+        args = process_script_args(script, opt_index, req.script_args)
 
     width, height = sddebz_highres_fix(
         req.base_size,
@@ -126,42 +322,25 @@ def f_txt2img(req: Txt2ImgRequest):
         req.disable_sddebz_highres,
     )
 
-    output = wrap_gradio_gpu_call(modules.txt2img.txt2img)(
-        "",  # id_task (used by wrap_gradio_gpu_call for some sort of job id system)
-        parse_prompt(req.prompt),  # prompt
-        parse_prompt(req.negative_prompt),  # negative_prompt
-        "None",  # prompt_styles: saved prompt styles (unsupported)
-        req.steps,  # steps
-        get_sampler_index(req.sampler_name),  # sampler_index
-        req.restore_faces,  # restore_faces
-        req.tiling,  # tiling
-        req.batch_count,  # n_iter
-        req.batch_size,  # batch_size
-        req.cfg_scale,  # cfg_scale
-        req.seed,  # seed
-        req.subseed,  # subseed
-        req.subseed_strength,  # subseed_strength
-        req.seed_resize_from_h,  # seed_resize_from_h
-        req.seed_resize_from_w,  # seed_resize_from_w
-        req.seed_enable_extras,  # seed_enable_extras
-        height,  # height
-        width,  # width
-        req.highres_fix,  # enable_hr: high res fix
-        req.denoising_strength,  # denoising_strength: only applicable if high res fix in use
-        0,  # hr_scale (overrided by hr_resize_x/y)
-        req.upscaler_name,  # hr_upscaler: upscaler to use for highres fix
-        0,  # hr_second_pass_steps: 0 uses same num of steps as generation to refine details
-        req.orig_width,  # hr_resize_x
-        req.orig_height,  # hr_resize_y
-        [],  # override_settings_texts (unsupported)
-        *args,
-    )
-    images = output[0]
-    info = output[1]
+    if reuse is not None and "txt2img" in reuse:
+        # consecutive batches of the same request only differ by seed
+        pipe = reuse["txt2img"]
+    else:
+        p = create_txt2img(req, width, height)
+        pipe = Pipeline(p, modules.scripts.scripts_txt2img, script, args)
+        if reuse is not None:
+            reuse["txt2img"] = pipe
+
+    try:
+        with stage("generate"):
+            images, info = pipe.run(seed=req.seed, subseed=req.subseed)
+    finally:
+        if reuse is None:
+            pipe.close()
 
     if images is None or len(images) < 1:
         log.warning("Interrupted!")
-        return {"outputs": [], "info": info}
+        return [], info
 
     if shared.opts.return_grid:
         if not req.include_grid and len(images) > 1 and script_ind == 0:
@@ -171,10 +350,11 @@ def f_txt2img(req: Txt2ImgRequest):
         log.info(
             f"img size: {images[0].width}x{images[0].height}, target: {req.orig_width}x{req.orig_height}"
         )
-        images = [
-            modules.images.resize_image(0, image, req.orig_width, req.orig_height)
-            for image in images
-        ]
+        with stage("resize"):
+            images = [
+                modules.images.resize_image(0, image, req.orig_width, req.orig_height)
+                for image in images
+            ]
 
     # save images for debugging/logging purposes
     if req.save_samples:
@@ -184,114 +364,156 @@ def f_txt2img(req: Txt2ImgRequest):
         ]
         log.info(f"saved: {output_paths}")
 
-    images = [img_to_b64(image) for image in images]
+    return images, info
 
-    log.info(f"output sizes: {[len(i) for i in images]}")
-    log.info(f"finished txt2img!")
-    return {"outputs": images, "info": info}
+
+# requests differing only by seed are batched together
+coalesce_txt2img = Coalescer(run_txt2img)
 
 
 @router.post("/img2img", response_model=ImageResponse)
 def f_img2img(req: Img2ImgRequest):
     """Post request for Img2Img.
 
+    If `checkpoint_cache` is set (in the request or config), it overrides the
+    webUI's own "Checkpoints to cache in RAM" setting.
+
     Args:
         req (Img2ImgRequest): Request.
 
     Returns:
         Dict: Outputs and info.
     """
-    log.info(f"img2img:\n{req.dict(exclude={'src_img', 'mask_img'})}")
+    with stage("decode"):
+        image = b64_to_img(req.src_img)
+        mask = None if req.mask_img is None else b64_to_img(req.mask_img)
+    req = merge_default_config(req, load_config().img2img)
+    images, info = run_cached(run_img2img, req, image, mask)
+    offsets = get_offsets(images)
+    with stage("encode"):
+        images = encode_imgs(images, req.output_format)
+
+    log.info(f"output sizes: {[len(i) for i in images]}")
+    log.info(f"finished img2img!")
+    return {"outputs": images, "info": info, "offsets": offsets}
 
-    opt = load_config().img2img
-    req = merge_default_config(req, opt)
-    prepare_backend(req)
 
-    script_ind, script, meta = get_script_info(req.script, True)
-    args = process_script_args(script_ind, script, meta, req.script_args)
+@router.post("/raw/img2img")
+async def f_img2img_raw(req: Request):
+    """Post request for Img2Img with binary transport. See `pack_parts`.
 
-    image = b64_to_img(req.src_img)
-    mask = (
-        prepare_mask(b64_to_img(req.mask_img))
-        if req.is_inpaint and req.mask_img is not None
-        else None
+    Args:
+        req (Request): Request with packed `Img2ImgRequest` as body, where
+            `src_img` & `mask_img` are raw image bytes.
+
+    Returns:
+        Response: Packed outputs (raw image bytes) and info.
+    """
+    with stage("decode"):
+        opts, imgs = parse_raw(
+            await req.body(), DefaultImg2ImgOptions, src_img=True, mask_img=False
+        )
+    image, mask = imgs["src_img"], imgs["mask_img"]
+    opts = merge_default_config(opts, load_config().img2img)
+
+    images, info = await run_in_threadpool(run_cached, run_img2img, opts, image, mask)
+    offsets = get_offsets(images)
+    with stage("encode"):
+        images = await run_in_threadpool(encode_imgs, images, opts.output_format, False)
+
+    log.info(f"output sizes: {[len(i) for i in images]}")
+    log.info(f"finished img2img!")
+    return Response(
+        pack_parts({"outputs": images, "info": info, "offsets": offsets}),
+        media_type=RAW_CONTENT_TYPE,
     )
 
+
+@router.post("/stream/img2img")
+async def f_img2img_stream(req: Request):
+    """Post request for Img2Img that streams outputs batch by batch as they are
+    generated. See `stream_batches`.
+
+    Args:
+        req (Request): Request with packed `Img2ImgRequest` as body, where
+            `src_img` & `mask_img` are raw image bytes.
+
+    Returns:
+        StreamingResponse: Frames of packed outputs and info.
+    """
+    with stage("decode"):
+        opts, imgs = parse_raw(
+            await req.body(), DefaultImg2ImgOptions, src_img=True, mask_img=False
+        )
+    image, mask = imgs["src_img"], imgs["mask_img"]
+    opts = merge_default_config(opts, load_config().img2img)
+
+    run = lambda r: run_cached(run_img2img, r, image, mask)
+    return StreamingResponse(stream_batches(run, opts), media_type=STREAM_CONTENT_TYPE)
+
+
+def run_img2img(req: DefaultImg2ImgOptions, image: Image.Image, mask: Image.Image):
+    """Run Img2Img/Inpaint.
+
+    Args:
+        req (DefaultImg2ImgOptions): Request.
+        image (Image): Source image.
+        mask (Image): Mask image (with mask in alpha channel). Only used for inpainting.
+
+    Returns:
+        Tuple[List[Image], str]: Output images and info.
+    """
+    log.info(f"img2img:\n{req.dict(exclude={'src_img', 'mask_img'})}")
+
+    with stage("config"):
+        opt = load_config().img2img
+        req = merge_default_config(req, opt)
+    with stage("prepare"):
+        prepare_backend(req)
+
+    with stage("script_args"):
+        script_ind, script, opt_index = get_script_info(req.script, True)
+        args = process_script_args(script, opt_index, req.script_args)
+
+    mask = prepare_mask(mask) if req.is_inpaint and mask is not None else None
+
+    # only inpaint region around mask, so diffusion runs at model resolution
+    # over that region instead of the whole image
+    full_image, full_mask, box = image, mask, None
+    if req.is_inpaint and req.inpaint_full_res and mask is not None and not script:
+        box = get_mask_box(mask, max(req.inpaint_full_res_padding, 0), req.invert_mask)
+        if box is not None and box != (0, 0, *image.size):
+            log.info(f"inpainting only masked region: {box}")
+            image, mask = image.crop(box), mask.crop(box)
+        else:
+            box = None
+
     orig_width, orig_height = image.size
 
     if script and script.title() == NAME_SCRIPT_UPSCALE:
         # in SD upscale mode, width & height determines tile size
         width = height = req.base_size
     else:
+        # masked region is always generated at model resolution, however small
         width, height = sddebz_highres_fix(
             req.base_size,
             req.max_size,
             orig_width,
             orig_height,
-            req.disable_sddebz_highres,
+            req.disable_sddebz_highres and box is None,
         )
 
-    # NOTE:
-    # - image & mask repeated due to Gradio API have separate tabs for each mode...
-    # - mask is used only in inpaint mode
-    # - mask_mode determines whethere init_img_with_mask or init_img_inpaint is used,
-    #   I dont know why
-    # - new color sketch functionality in webUI is irrelevant so None is used for their options.
-    # - the internal code for img2img is confusing and duplicative...
-
-    output = wrap_gradio_gpu_call(modules.img2img.img2img)(
-        "",  # id_task (used by wrap_gradio_gpu_call for some sort of job id system)
-        4
-        if req.is_inpaint
-        else 0,  # mode (we use 0 (img2img with init_img) & 4 (inpaint uploaded mask))
-        parse_prompt(req.prompt),  # prompt
-        parse_prompt(req.negative_prompt),  # negative_prompt
-        "None",  # prompt_styles: saved prompt styles (unsupported)
-        image,  # init_img
-        None,  # sketch (unused by us)
-        None,  # init_img_with_mask (unused by us)
-        None,  # inpaint_color_sketch (unused by us)
-        None,  # inpaint_color_sketch_orig (unused by us)
-        image,  # init_img_inpaint
-        mask,  # init_mask_inpaint
-        req.steps,  # steps
-        get_sampler_index(req.sampler_name),  # sampler_index
-        0,  # req.mask_blur,  # mask_blur
-        None,  # mask_alpha (unused by us) # only used by webUI color sketch if init_img_with_mask isn't dict
-        req.inpainting_fill,  # inpainting_fill
-        req.restore_faces,  # restore_faces
-        req.tiling,  # tiling
-        req.batch_count,  # n_iter
-        req.batch_size,  # batch_size
-        req.cfg_scale,  # cfg_scale
-        0, # img_cfg_scale (unsupported)
-        req.denoising_strength,  # denoising_strength
-        req.seed,  # seed
-        req.subseed,  # subseed
-        req.subseed_strength,  # subseed_strength
-        req.seed_resize_from_h,  # seed_resize_from_h
-        req.seed_resize_from_w,  # seed_resize_from_w
-        req.seed_enable_extras,  # seed_enable_extras
-        1,  # selected_scale_tab
-        height,  # height
-        width,  # width
-        1.0,  # scale_by
-        req.resize_mode,  # resize_mode
-        False,  # req.inpaint_full_res,  # inpaint_full_res
-        0,  # req.inpaint_full_res_padding,  # inpaint_full_res_padding
-        req.invert_mask,  # inpainting_mask_invert
-        "",  # img2img_batch_input_dir (unspported)
-        "",  # img2img_batch_output_dir (unsupported)
-        "",  # img2img_batch_inpaint_mask_dir (unsupported)
-        [],  # override_settings_texts (unsupported)
-        *args,
-    )
-    images = output[0]
-    info = output[1]
+    p = create_img2img(req, image, mask, width, height)
+    pipe = Pipeline(p, modules.scripts.scripts_img2img, script, args)
+    try:
+        with stage("generate"):
+            images, info = pipe.run()
+    finally:
+        pipe.close()
 
     if images is None or len(images) < 1:
         log.warning("Interrupted!")
-        return {"outputs": [], "info": info}
+        return [], info
 
     if shared.opts.return_grid:
         if not req.include_grid and len(images) > 1 and script_ind == 0:
@@ -307,20 +529,19 @@ def f_img2img(req: Img2ImgRequest):
         log.info(
             f"img Size: {images[0].width}x{images[0].height}, target: {orig_width}x{orig_height}"
         )
-        images = [
-            modules.images.resize_image(0, image, orig_width, orig_height)
-            for image in images
-        ]
-
-    if req.is_inpaint:
-
-        def apply_mask(img):
-            """Mask inpaint using original mask, including alpha."""
-            r, g, b = img.split()  # img2img/inpaint gives rgb image
-            a = ImageOps.invert(mask) if req.invert_mask else mask
-            return Image.merge("RGBA", (r, g, b, a))
-
-        images = [apply_mask(x) for x in images]
+        with stage("resize"):
+            images = [
+                modules.images.resize_image(0, image, orig_width, orig_height)
+                for image in images
+            ]
+
+    with stage("mask"):
+        if box is not None:
+            # paste generated region back into the original image & mask it
+            images = apply_mask(images, full_mask, req.invert_mask, full_image, box)
+        elif req.is_inpaint and mask is not None:
+            # mask inpaint using original mask, including alpha
+            images = apply_mask(images, mask, req.invert_mask)
 
     # save images for debugging/logging purposes
     if req.save_samples:
@@ -330,11 +551,13 @@ def f_img2img(req: Img2ImgRequest):
         ]
         log.info(f"saved: {output_paths}")
 
-    images = [img_to_b64(image) for image in images]
+    # only return the region that could have changed
+    if req.is_inpaint and req.trim_to_mask and full_mask is not None:
+        trim_box = get_mask_box(full_mask, 0, req.invert_mask)
+        if trim_box is not None and images[0].size == full_mask.size:
+            images = [trim_img(image, trim_box) for image in images]
 
-    log.info(f"output sizes: {[len(i) for i in images]}")
-    log.info(f"finished img2img!")
-    return {"outputs": images, "info": info}
+    return images, info
 
 
 @router.post("/upscale", response_model=UpscaleResponse)
@@ -347,36 +570,371 @@ def f_upscale(req: UpscaleRequest):
     Returns:
         Dict: Output.
     """
-    log.info(f"upscale:\n{req.dict(exclude={'src_img'})}")
+    with stage("decode"):
+        image = b64_to_img(req.src_img)
+    image = run_upscale(req, image)
+    if image is None:
+        return
 
-    opt = load_config().upscale
-    req = merge_default_config(req, opt)
-    prepare_backend(req)
+    with stage("encode"):
+        output = img_to_b64(image, req.output_format)
+    log.info(f"output size: {len(output)}")
+    log.info("finished upscale!")
+    return {"output": output}
 
-    image = b64_to_img(req.src_img).convert("RGB")
-    orig_width, orig_height = image.size
+
+@router.post("/raw/upscale")
+async def f_upscale_raw(req: Request):
+    """Post request for upscaling with binary transport. See `pack_parts`.
+
+    Args:
+        req (Request): Request with packed `UpscaleRequest` as body, where
+            `src_img` is raw image bytes.
+
+    Returns:
+        Response: Packed output (raw image bytes).
+    """
+    with stage("decode"):
+        opts, imgs = parse_raw(await req.body(), DefaultUpscaleOptions, src_img=True)
+    image = imgs["src_img"]
+
+    image = await run_in_threadpool(run_upscale, opts, image)
+    if image is None:
+        return
+
+    with stage("encode"):
+        output = await run_in_threadpool(img_to_bytes, image, opts.output_format)
+    log.info(f"output size: {len(output)}")
+    log.info("finished upscale!")
+    return Response(pack_parts({"output": output}), media_type=RAW_CONTENT_TYPE)
+
+
+@router.post("/upscale/batch", response_model=BatchUpscaleResponse)
+def f_upscale_batch(req: BatchUpscaleRequest):
+    """Post request for upscaling several images at once.
+
+    Args:
+        req (BatchUpscaleRequest): Request.
+
+    Returns:
+        Dict: Outputs in the same order as `src_imgs`.
+    """
+    with stage("decode"):
+        images = [b64_to_img(img) for img in req.src_imgs]
+    images = run_upscale_batch(req, images)
+    if images is None:
+        return
+
+    with stage("encode"):
+        outputs = encode_imgs(images, req.output_format)
+    log.info(f"output sizes: {[len(o) for o in outputs]}")
+    log.info("finished batch upscale!")
+    return {"outputs": outputs}
+
+
+@router.post("/raw/upscale/batch")
+async def f_upscale_batch_raw(req: Request):
+    """Post request for upscaling several images at once with binary transport.
+    See `pack_parts`.
+
+    Args:
+        req (Request): Request with packed `BatchUpscaleRequest` as body, where
+            `src_imgs` are raw image bytes.
+
+    Returns:
+        Response: Packed outputs (raw image bytes).
+    """
+    with stage("decode"):
+        opts, imgs = parse_raw(await req.body(), DefaultUpscaleOptions, src_imgs=True)
+    images = imgs["src_imgs"]
+
+    images = await run_in_threadpool(run_upscale_batch, opts, images)
+    if images is None:
+        return
+
+    with stage("encode"):
+        outputs = await run_in_threadpool(
+            encode_imgs, images, opts.output_format, False
+        )
+    log.info(f"output sizes: {[len(o) for o in outputs]}")
+    log.info("finished batch upscale!")
+    return Response(pack_parts({"outputs": outputs}), media_type=RAW_CONTENT_TYPE)
+
+
+def run_upscale(req: DefaultUpscaleOptions, image: Image.Image):
+    """Run upscaler.
+
+    Args:
+        req (DefaultUpscaleOptions): Request.
+        image (Image): Image to upscale.
+
+    Returns:
+        Union[Image, None]: Upscaled image, or None if no upscaler was selected.
+    """
+    images = run_upscale_batch(req, [image])
+    return None if images is None else images[0]
+
+
+def run_upscale_batch(req: DefaultUpscaleOptions, images: List[Image.Image]):
+    """Run upscaler on several images.
+
+    If the upscaler runs on the CPU (a PIL resize, or the webUI is CPU-only),
+    images are upscaled in parallel on a shared pool, at most
+    UPSCALE_MAX_PARALLEL at once for this request. Otherwise they are upscaled
+    one after another, as GPU upscalers would contend for VRAM.
+
+    Args:
+        req (DefaultUpscaleOptions): Request.
+        images (List[Image]): Images to upscale.
+
+    Returns:
+        Union[List[Image], None]: Upscaled images in the same order, or None if no upscaler was selected.
+    """
+    log.info(f"upscale:\n{req.dict(exclude={'src_img', 'src_imgs'})}")
+
+    with stage("config"):
+        opt = load_config().upscale
+        req = merge_default_config(req, opt)
+    with stage("prepare"):
+        prepare_backend(req)
 
     upscaler_index = get_upscaler_index(req.upscaler_name)
     upscaler = shared.sd_upscalers[upscaler_index]
 
     if upscaler.name == "None":
         log.info(f"No upscaler selected, will do nothing")
-        return
-
-    if req.downscale_first:
-        image = modules.images.resize_image(0, image, orig_width // 2, orig_height // 2)
+        return None
+
+    def upscale(img):
+        return upscaler.scaler.upscale(img, upscaler.scale, upscaler.data_path)
+
+    def run(image):
+        image = image.convert("RGB")
+        orig_width, orig_height = image.size
+        if req.downscale_first:
+            image = modules.images.resize_image(
+                0, image, orig_width // 2, orig_height // 2
+            )
+        if req.tile_size > 0 and max(image.size) > req.tile_size:
+            return upscale_tiled(upscale, image, req.tile_size, req.tile_overlap)
+        return upscale(image)
+
+    is_cpu = (
+        upscaler.name in NAMES_PIL_UPSCALERS or modules.devices.device.type == "cpu"
+    )
+    with stage("upscale"):
+        if is_cpu and len(images) > 1:
+            images = map_parallel(run, images)
+        else:
+            images = [run(image) for image in images]
 
-    image = upscaler.scaler.upscale(image, upscaler.scale, upscaler.data_path)
     if req.save_samples:
-        output_path = save_img(
-            image, opt.sample_path, filename=f"{int(time.time())}.png"
-        )
-        log.info(f"saved: {output_path}")
+        output_paths = [
+            save_img(image, opt.sample_path, filename=f"{int(time.time())}_{i}.png")
+            for i, image in enumerate(images)
+        ]
+        log.info(f"saved: {output_paths}")
+
+    return images
+
+
+def apply_backend_config():
+    """Apply the `backend` section of the config, which can be edited while running."""
+    cfg = load_config().backend
+    coalesce_txt2img.window = cfg.coalesce_window
+    result_cache.max_size = cfg.result_cache_size
 
-    output = img_to_b64(image)
-    log.info(f"output size: {len(output)}")
-    log.info("finished upscale!")
-    return {"output": output}
+
+def run_cached(run: Callable, req: DefaultTxt2ImgOptions, *images: Image.Image):
+    """Run request, serving it from `result_cache` if it is deterministic (i.e.
+    has a fixed seed) & was already done before. Cached outputs are still saved
+    if `save_samples` is set.
+
+    Args:
+        run (Callable): `run_txt2img`, `run_img2img` or a wrapper of them.
+        req (DefaultTxt2ImgOptions): Request with defaults already merged.
+        images (Image): Source images passed to `run` after the request, if any.
+
+    Returns:
+        Tuple[List[Image], str]: Output images and info.
+    """
+    apply_backend_config()
+    if not result_cache.is_cacheable(req):
+        return run(req, *images)
+
+    prepare_backend(req)
+    key = result_cache.get_key(req, *images)
+    result = result_cache.get(key)
+    if result is not None:
+        log.info(f"serving cached result: {key}")
+        if req.save_samples:
+            output_paths = [
+                save_img(image, req.sample_path, filename=f"{int(time.time())}_{i}.png")
+                for i, image in enumerate(result[0])
+            ]
+            log.info(f"saved: {output_paths}")
+        return result
+
+    outputs, info = run(req, *images)
+    if len(outputs) > 0 and not shared.state.interrupted:
+        result_cache.put(key, outputs, info)
+    return outputs, info
+
+
+def stream_batches(run: Callable, req: DefaultTxt2ImgOptions):
+    """Run request one batch at a time, yielding each batch's outputs as a frame
+    (see `pack_frame`) as soon as it is done.
+
+    Frames have the same keys as the raw routes' responses, plus `done`, which
+    is True for the last frame. If generation fails, the last frame only has
+    `error` & `done`. Requests using a script aren't split, as scripts
+    may depend on `batch_count` (i.e. Loopback).
+
+    Args:
+        run (Callable): `run_txt2img` or `run_img2img`.
+        req (DefaultTxt2ImgOptions): Request with defaults already merged.
+
+    Yields:
+        bytes: Frame.
+    """
+    if req.script == "None" and req.batch_count > 1:
+        # same seeds as when the whole batch is done at once
+        step = req.batch_size
+        reqs = [
+            req.copy(
+                update=dict(
+                    batch_count=1,
+                    seed=req.seed if req.seed == -1 else req.seed + i * step,
+                    subseed=(
+                        req.subseed if req.subseed == -1 else req.subseed + i * step
+                    ),
+                ),
+                deep=True,
+            )
+            for i in range(req.batch_count)
+        ]
+    else:
+        reqs = [req]
+
+    try:
+        for i, r in enumerate(reqs):
+            images, info = run(r)
+            done = i == len(reqs) - 1 or shared.state.interrupted
+            with stage("encode"):
+                outputs = encode_imgs(images, r.output_format, False)
+            log.info(
+                f"streaming batch {i + 1}/{len(reqs)}, sizes: {[len(o) for o in outputs]}"
+            )
+            offsets = get_offsets(images)
+            yield pack_frame(
+                {"outputs": outputs, "info": info, "offsets": offsets, "done": done}
+            )
+            if done:
+                break
+    except Exception as e:
+        # status code was already sent, so report the error in the last frame
+        log.exception("streaming failed")
+        yield pack_frame({"error": str(e), "done": True})
+
+
+def submit_job(kind: str, fn: Callable, *args):
+    """Queue job, see `JobStore.submit`."""
+    try:
+        return jobs.submit(kind, fn, *args).info()
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+def get_job(job_id: str):
+    """Get job, see `JobStore.get`."""
+    try:
+        return jobs.get(job_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.post("/jobs/txt2img", response_model=JobResponse)
+def f_txt2img_job(req: Txt2ImgRequest):
+    """Queue Txt2Img job. Result is the same as `/txt2img`.
+
+    Args:
+        req (Txt2ImgRequest): Request.
+
+    Returns:
+        Dict: Job status.
+    """
+    return submit_job("txt2img", f_txt2img, req)
+
+
+@router.post("/jobs/img2img", response_model=JobResponse)
+def f_img2img_job(req: Img2ImgRequest):
+    """Queue Img2Img job. Result is the same as `/img2img`.
+
+    Args:
+        req (Img2ImgRequest): Request.
+
+    Returns:
+        Dict: Job status.
+    """
+    return submit_job("img2img", f_img2img, req)
+
+
+@router.post("/jobs/upscale", response_model=JobResponse)
+def f_upscale_job(req: UpscaleRequest):
+    """Queue upscale job. Result is the same as `/upscale`.
+
+    Args:
+        req (UpscaleRequest): Request.
+
+    Returns:
+        Dict: Job status.
+    """
+    return submit_job("upscale", f_upscale, req)
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+def f_job_status(job_id: str):
+    """Get status of job.
+
+    Args:
+        job_id (str): Id of job.
+
+    Returns:
+        Dict: Job status.
+    """
+    return get_job(job_id).info()
+
+
+@router.get("/jobs/{job_id}/result")
+def f_job_result(job_id: str):
+    """Get result of finished job. Results are kept for `JOB_TTL` seconds.
+
+    Args:
+        job_id (str): Id of job.
+
+    Returns:
+        Dict: Response of the route the job is for.
+    """
+    job = get_job(job_id)
+    if not job.is_finished:
+        raise HTTPException(status_code=409, detail=f"job is {job.status}")
+    if job.status == JOB_FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    return job.result
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=JobResponse)
+def f_job_cancel(job_id: str):
+    """Cancel job. Queued jobs are dropped & the running job is interrupted.
+
+    Args:
+        job_id (str): Id of job.
+
+    Returns:
+        Dict: Job status.
+    """
+    get_job(job_id)
+    return jobs.cancel(job_id).info()
 
 
 async def app_encryption_middleware(req: Request, call_next):
@@ -398,6 +956,14 @@ async def app_encryption_middleware(req: Request, call_next):
     res: StreamingResponse = await call_next(req)
     if is_encrypted:
         res.headers["X-Encrypted-Body"] = req.headers["X-Encrypted-Body"]
-        body = [bytewise_xor(chunk, key) async for chunk in res.body_iterator]
-        res.body_iterator = iterate_in_threadpool(iter(body))
+        body_iterator = res.body_iterator
+
+        # encrypt chunks as they stream through instead of buffering the whole body
+        async def encrypt():
+            pos = 0
+            async for chunk in body_iterator:
+                yield bytewise_xor(chunk, key, pos)
+                pos += len(chunk)
+
+        res.body_iterator = encrypt()
     return res
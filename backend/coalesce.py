@@ -0,0 +1,170 @@
+"""
+Merges concurrent txt2img requests that differ only in seed into one larger
+batch, to make better use of the GPU when many clients share a backend.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict
+
+import modules
+
+from .config import COALESCE_MAX_BATCH, COALESCE_WINDOW, LOGGER_NAME
+
+log = logging.getLogger(LOGGER_NAME)
+
+
+class Group:
+    def __init__(self):
+        """Requests to be run together as one batch."""
+        self.reqs = []
+        self.size = 0
+        self.closed = False
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+    def add(self, req):
+        """Add request to group, returning its index."""
+        self.reqs.append(req)
+        self.size += req.batch_size
+        return len(self.reqs) - 1
+
+
+class Coalescer:
+    def __init__(
+        self,
+        run: Callable,
+        window: float = COALESCE_WINDOW,
+        max_batch: int = COALESCE_MAX_BATCH,
+    ):
+        """Coalesce requests to `run` that only differ by seed.
+
+        The first compatible request waits `window` seconds for others to join
+        it, then all of them are run as a single batch of up to `max_batch`
+        images, with each request keeping its own seeds.
+
+        Args:
+            run (Callable): Function taking a request & returning (images, info).
+            window (float, optional): Seconds to wait for requests to join. Defaults to COALESCE_WINDOW.
+            max_batch (int, optional): Max combined batch size. Defaults to COALESCE_MAX_BATCH.
+        """
+        self.run = run
+        self.window = window
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.groups: Dict[str, Group] = {}
+
+    def is_compatible(self, req):
+        """Whether request can be merged with others."""
+        return (
+            self.window > 0
+            and req.script == "None"
+            and req.batch_count == 1
+            and req.batch_size < self.max_batch
+            and not req.include_grid
+            and not req.seed_enable_extras
+        )
+
+    def get_key(self, req):
+        """Requests with the same key can be merged."""
+        obj = req.dict(exclude={"seed", "subseed", "batch_size"})
+        return json.dumps(obj, sort_keys=True, default=str)
+
+    def __call__(self, req):
+        """Run request, possibly merged with others.
+
+        Args:
+            req (Any): Request with defaults already merged.
+
+        Returns:
+            Tuple[List[Image], str]: Output images and info for this request only.
+        """
+        if not self.is_compatible(req):
+            return self.run(req)
+
+        key = self.get_key(req)
+        with self.lock:
+            group = self.groups.get(key)
+            is_leader = (
+                group is None
+                or group.closed
+                or group.size + req.batch_size > self.max_batch
+            )
+            if is_leader:
+                group = self.groups[key] = Group()
+            index = group.add(req)
+
+        if is_leader:
+            time.sleep(self.window)
+            with self.lock:
+                group.closed = True
+                if self.groups.get(key) is group:
+                    del self.groups[key]
+            try:
+                group.results = self.run_group(group.reqs)
+            except Exception as e:
+                group.error = e
+            finally:
+                group.done.set()
+        else:
+            group.done.wait()
+
+        if group.error is not None:
+            raise group.error
+        return group.results[index]
+
+    def run_group(self, reqs: list):
+        """Run requests as one batch & split the outputs back."""
+        if len(reqs) == 1:
+            return [self.run(reqs[0])]
+
+        # every image gets the seed it would have had if run separately
+        seeds = []
+        for req in reqs:
+            seed = int(modules.processing.get_fixed_seed(req.seed))
+            seeds += [seed + i for i in range(req.batch_size)]
+        size = len(seeds)
+        log.info(f"coalesced {len(reqs)} requests into batch of {size}")
+
+        merged = reqs[0].copy(update=dict(batch_size=size, seed=seeds), deep=True)
+        images, info = self.run(merged)
+
+        results, pos = [], 0
+        for req in reqs:
+            n = req.batch_size
+            results.append(
+                (images[pos : pos + n], split_info(info, pos, n, size))
+                if len(images) == size
+                else ([], info)  # interrupted
+            )
+            pos += n
+        return results
+
+
+def split_info(info: str, start: int, count: int, total: int):
+    """Slice per-image lists in jsonified generation info.
+
+    Args:
+        info (str): Generation info already jsonified.
+        start (int): Index of first image.
+        count (int): Number of images.
+        total (int): Number of images in the whole batch.
+
+    Returns:
+        str: Generation info for the slice.
+    """
+    try:
+        obj = json.loads(info)
+    except (TypeError, json.JSONDecodeError):
+        return info
+    for k, v in obj.items():
+        if isinstance(v, list) and len(v) == total:
+            obj[k] = v[start : start + count]
+    if obj.get("all_seeds"):
+        obj["seed"] = obj["all_seeds"][0]
+    obj["batch_size"] = count
+    return json.dumps(obj)
@@ -0,0 +1,127 @@
+"""
+In-memory cache of text conditioning (CLIP output), so requests repeating the
+same prompts (i.e. only the seed or mask changed) skip text encoding.
+"""
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import modules
+from modules import shared
+
+from .config import COND_CACHE_SIZE, LOGGER_NAME
+from .models import get_loaded_checkpoint
+
+log = logging.getLogger(LOGGER_NAME)
+
+# extra networks (i.e. <lora:name:1>) are stripped from the prompt before it is
+# encoded, but change the text encoder's weights
+EXTRA_NETWORK_PATTERN = re.compile(r"<[^>]+>")
+
+
+def get_embeddings_key():
+    """Names of loaded textual inversion embeddings, which the encoding depends on."""
+    hijack = getattr(getattr(modules, "sd_hijack", None), "model_hijack", None)
+    db = getattr(hijack, "embedding_db", None)
+    return None if db is None else tuple(sorted(db.word_embeddings))
+
+
+def get_texts_key(texts: list):
+    """Texts to encode, including attributes the webUI may attach to the list
+    (i.e. size & whether it is the negative prompt, used by SDXL).
+    """
+    attrs = getattr(texts, "__dict__", {})
+    extra = tuple(
+        (k, v)
+        for k, v in sorted(attrs.items())
+        if isinstance(v, (str, int, float, bool, type(None)))
+    )
+    return tuple(texts), extra
+
+
+class ConditioningCache:
+    def __init__(self, max_size: int = COND_CACHE_SIZE):
+        """LRU cache of the model's text conditioning.
+
+        Entries are keyed by model, clip skip, extra networks in the prompts,
+        loaded embeddings & the texts being encoded. Conditioning stays on the
+        device it was computed on.
+
+        Args:
+            max_size (int, optional): Max number of entries, 0 disables. Defaults to COND_CACHE_SIZE.
+        """
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get(self, key: tuple):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: tuple, cond):
+        with self.lock:
+            self.entries[key] = cond
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    @contextmanager
+    def use(self, p):
+        """Serve the loaded model's text conditioning from the cache while
+        processing `p`. Only use while holding the webUI's queue lock, as the
+        model is patched for the duration.
+
+        Args:
+            p (StableDiffusionProcessing): Processing object about to be run.
+        """
+        model = shared.sd_model
+        if self.max_size <= 0 or not hasattr(model, "get_learned_conditioning"):
+            yield
+            return
+
+        info = get_loaded_checkpoint()
+        prompts = f"{p.prompt} {p.negative_prompt}"
+        base_key = (
+            getattr(info, "sha256", None) or getattr(info, "filename", None),
+            shared.opts.CLIP_stop_at_last_layers,
+            tuple(sorted(set(EXTRA_NETWORK_PATTERN.findall(prompts)))),
+        )
+        encode = model.get_learned_conditioning
+        patched = model.__dict__.get("get_learned_conditioning")
+
+        def get_learned_conditioning(texts):
+            # embeddings are (re)loaded by the webUI at the start of processing
+            key = (*base_key, get_embeddings_key(), get_texts_key(texts))
+            cond = self.get(key)
+            if cond is None:
+                cond = encode(texts)
+                self.put(key, cond)
+            return cond
+
+        model.get_learned_conditioning = get_learned_conditioning
+        try:
+            yield
+        finally:
+            if patched is None:
+                del model.get_learned_conditioning
+            else:
+                model.get_learned_conditioning = patched
+            log.info(f"conditioning cache: {self.hits} hits, {self.misses} misses")
+
+
+cond_cache = ConditioningCache()
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
-from typing import Any
+from typing import Any, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, validator
 
 SCRIPT_NAME = "Interpause Backend API"
 SCRIPT_ID = "interpause_backend_api"
@@ -10,17 +10,68 @@ ROUTE_PREFIX = "/sdapi/interpause"
 CONFIG_PATH = "auto-sd-paint-ext-backend.yaml"
 LOGGER_NAME = "auto-sd-paint-ext"
 ENCRYPT_FILE = "xor_pass.txt"
+RESULT_CACHE_PATH = "outputs/krita-cache"
+"""Where results of requests with a fixed seed are cached."""
+RESULT_CACHE_SIZE = 0
+"""Default max size in bytes of the result cache. 0 disables."""
+COND_CACHE_SIZE = 64
+"""Max number of prompts whose text conditioning is kept (on the GPU) for reuse. 0 disables."""
+COALESCE_WINDOW = 0
+"""Default seconds a txt2img request waits for others differing only by seed to be batched with. 0 disables."""
+COALESCE_MAX_BATCH = 8
+"""Max batch size of coalesced txt2img requests."""
+JOB_MAX_COUNT = 64
+"""Max number of jobs (queued, running or awaiting pickup) kept by the job API."""
+JOB_TTL = 600
+"""Seconds to keep results of finished jobs for pickup."""
+PROGRESS_INTERVAL = 0.1
+"""Seconds between checks for changes in progress pushed to subscribers."""
+PROGRESS_IDLE_TIMEOUT = 5
+"""Seconds without any job before a progress subscription is ended."""
+SAVE_WORKERS = 2
+"""Number of threads saving images when `save_samples` is enabled."""
+SAVE_QUEUE_SIZE = 16
+"""Max number of images pending to be saved before requests wait for saves to finish."""
+SAVE_COMPRESS_LEVEL = 1
+"""PNG compression level (0-9) of saved images; lower is faster but bigger."""
+UPSCALE_WORKERS = 4
+"""Number of threads upscaling images of batch upscale requests with CPU upscalers."""
+UPSCALE_MAX_PARALLEL = 2
+"""Max images of a single batch upscale request upscaled at once, so one request can't take all workers."""
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+"""Upper bounds in seconds of the histogram buckets served by /metrics."""
+RAW_CONTENT_TYPE = "application/x-sd-paint-parts"
+"""Content type of bodies packed by `utils.pack_parts` (binary image transport)."""
+STREAM_CONTENT_TYPE = "application/x-sd-paint-stream"
+"""Content type of streamed responses made of frames packed by `utils.pack_frame`."""
+RAW_IMAGE_MAGIC = b"RGBA"
+"""Prefix of images encoded with the raw `output_format`."""
 
 # names of scripts to apply workarounds for
 NAME_SCRIPT_LOOPBACK = "Loopback"
 NAME_SCRIPT_UPSCALE = "SD upscale"
 
+# names of upscalers that are plain PIL resizes (which release the GIL)
+NAMES_PIL_UPSCALERS = {"Lanczos", "Nearest"}
+
 
 class BaseOptions(BaseModel):
     sample_path: str = "outputs/krita-out"
     """Where to save generated images to."""
     save_samples: bool = False
     """Whether to save temporary images (useful for debugging)."""
+    output_format: str = "png"
+    """Format of returned images. One of png, png_fast, webp_lossless or raw (RGBA with dimensions)."""
+
+    @validator("output_format")
+    def check_output_format(cls, v):
+        """Reject unknown formats before generating instead of when encoding."""
+        # imported here as utils depends on this module
+        from .utils import IMAGE_CODECS
+
+        if v not in IMAGE_CODECS:
+            raise ValueError(f"must be one of: {', '.join(IMAGE_CODECS)}")
+        return v
 
 
 class GenerationOptions(BaseModel):
@@ -28,6 +79,8 @@ class GenerationOptions(BaseModel):
     """Model to use for generation."""
     sd_vae: str = "Automatic"
     """VAE to use for generation."""
+    checkpoint_cache: Optional[int] = None
+    """Number of recently used checkpoints to keep in RAM for faster switching. Overrides the webUI's setting if set."""
 
     clip_skip: int = 1
     """CLIP layers to skip during generation."""
@@ -113,15 +166,17 @@ class InpaintingOptions(BaseModel):
     inpainting_fill: int = 1
     """What to fill inpainted region with. 0 is blur/fill, 1 is original, 2 is latent noise, and 3 is latent empty."""
     inpaint_full_res: bool = False
-    """(DISABLED) Whether to use the full resolution for inpainting."""
-    inpaint_full_res_padding: int = 0
-    """(DISABLED) Padding when using full resolution for inpainting."""
+    """Whether to only inpaint the region around the mask, at full model resolution."""
+    inpaint_full_res_padding: int = 32
+    """Padding in pixels around the mask when only inpainting the region around it."""
     mask_blur: int = 0
     """(DISABLED) Size of blur at boundaries of mask."""
     invert_mask: bool = False
     """Whether to invert the mask."""
     inpaint_mask_weight: float = 1.0
     """Mask weight for specialized inpainting models."""
+    trim_to_mask: bool = False
+    """Whether to trim inpaint outputs to the bounding box of the mask. Where each output is in the source image is returned as `offsets`."""
 
 
 class Txt2ImgOptions(BaseOptions, GenerationOptions, FaceRestorationOptions):
@@ -149,14 +204,26 @@ class UpscaleOptions(BaseOptions):
     """Exact name of upscaler to use."""
     downscale_first: bool = False
     """Whether to downscale the image by x0.5 first."""
+    tile_size: int = 0
+    """Size in pixels of tiles to upscale the image in, which bounds memory use for large images. 0 disables tiling."""
+    tile_overlap: int = 32
+    """Overlap in pixels between tiles, which is blended to hide seams."""
 
 
 class PluginOptions(BaseOptions):
     sample_path: str = "outputs/krita-in"
 
 
+class BackendOptions(BaseModel):
+    coalesce_window: float = COALESCE_WINDOW
+    """Seconds a txt2img request waits for others differing only by seed to be batched with (needs more VRAM). 0 disables."""
+    result_cache_size: int = RESULT_CACHE_SIZE
+    """Max size in bytes of the cache of results of requests with a fixed seed, i.e. 1073741824 for 1GB. 0 disables."""
+
+
 class MainConfig(BaseModel):
     txt2img: Txt2ImgOptions = Txt2ImgOptions()
     img2img: Img2ImgOptions = Img2ImgOptions()
     upscale: UpscaleOptions = UpscaleOptions()
     plugin: PluginOptions = PluginOptions()
+    backend: BackendOptions = BackendOptions()
@@ -0,0 +1,210 @@
+"""
+Job system that lets clients submit a request, disconnect, and come back for
+the result later instead of holding a connection open for the whole generation.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from modules import shared
+
+from .config import JOB_MAX_COUNT, JOB_TTL, LOGGER_NAME
+
+log = logging.getLogger(LOGGER_NAME)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+
+class Job:
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        """Unique id of job."""
+        self.kind = kind
+        """Which route the job is for."""
+        self.status = JOB_QUEUED
+        """One of queued, running, done, failed or cancelled."""
+        self.result = None
+        """Response of route once done."""
+        self.error = None
+        """Error message if failed."""
+        self.cancelled = False
+        """Whether cancellation was requested."""
+        self.generating = False
+        """Whether the job's generation holds the webUI's queue lock right now."""
+        self.future = None
+        self.finished_at = None
+
+    @property
+    def is_finished(self):
+        return self.status in {JOB_DONE, JOB_FAILED, JOB_CANCELLED}
+
+    def info(self):
+        """Status of job to return to client."""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+class JobStore:
+    def __init__(self, max_count: int = JOB_MAX_COUNT, ttl: float = JOB_TTL):
+        """Bounded in-memory store of jobs, which are run one at a time.
+
+        Finished jobs are evicted after `ttl` seconds, or earlier (oldest first)
+        to make room for new jobs. Only unfinished jobs count towards `max_count`.
+
+        Args:
+            max_count (int, optional): Max number of unfinished jobs. Defaults to JOB_MAX_COUNT.
+            ttl (float, optional): Seconds to keep finished jobs. Defaults to JOB_TTL.
+        """
+        self.max_count = max_count
+        self.ttl = ttl
+        self.jobs: Dict[str, Job] = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # generation is serialized by the webUI anyways
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="sd_paint_jobs")
+
+    def evict(self, keep: int = None):
+        """Remove expired jobs, then oldest finished jobs while over capacity.
+
+        Args:
+            keep (int, optional): Max number of jobs to keep. Defaults to `max_count`.
+        """
+        keep = self.max_count if keep is None else keep
+        now = time.monotonic()
+        finished = [j for j in self.jobs.values() if j.is_finished]
+        for job in finished:
+            if now - job.finished_at > self.ttl:
+                del self.jobs[job.id]
+        finished = sorted(
+            (j for j in self.jobs.values() if j.is_finished),
+            key=lambda j: j.finished_at,
+        )
+        for job in finished[: max(0, len(self.jobs) - keep)]:
+            del self.jobs[job.id]
+
+    def submit(self, kind: str, fn: Callable, *args):
+        """Queue job.
+
+        Args:
+            kind (str): Which route the job is for.
+            fn (Callable): Function that returns the response of the route.
+
+        Raises:
+            OverflowError: Too many unfinished jobs.
+
+        Returns:
+            Job: Queued job.
+        """
+        with self.lock:
+            self.evict(self.max_count - 1)
+            unfinished = sum(not j.is_finished for j in self.jobs.values())
+            if unfinished >= self.max_count:
+                raise OverflowError(f"too many jobs queued: {unfinished}")
+            job = Job(kind)
+            self.jobs[job.id] = job
+            job.future = self.executor.submit(self.run, job, fn, *args)
+        log.info(f"job {job.id} ({kind}) queued")
+        return job
+
+    def run(self, job: Job, fn: Callable, *args):
+        with self.lock:
+            if job.cancelled:
+                return
+            job.status = JOB_RUNNING
+        self.local.job = job
+        try:
+            result = fn(*args)
+            error = None
+        except Exception as e:
+            log.exception(f"job {job.id} ({job.kind}) failed")
+            result, error = None, str(e)
+        finally:
+            self.local.job = None
+        with self.lock:
+            job.result = result
+            job.error = error
+            if job.cancelled:
+                job.status = JOB_CANCELLED
+            else:
+                job.status = JOB_DONE if error is None else JOB_FAILED
+            job.finished_at = time.monotonic()
+        log.info(f"job {job.id} ({job.kind}) {job.status}")
+
+    def begin_generation(self):
+        """Called once generation has taken the webUI's queue lock & begun
+        `shared.state`. Interrupts right away if the job running on this thread
+        was cancelled while waiting for the lock.
+        """
+        job = getattr(self.local, "job", None)
+        if job is None:
+            return
+        with self.lock:
+            if job.cancelled:
+                shared.state.interrupt()
+            job.generating = True
+
+    def end_generation(self):
+        """Called before generation releases the webUI's queue lock."""
+        job = getattr(self.local, "job", None)
+        if job is None:
+            return
+        with self.lock:
+            job.generating = False
+
+    def get(self, job_id: str):
+        """Get job by id.
+
+        Args:
+            job_id (str): Id of job.
+
+        Raises:
+            KeyError: Job doesn't exist or was evicted.
+
+        Returns:
+            Job: Job.
+        """
+        with self.lock:
+            self.evict()
+            if job_id not in self.jobs:
+                raise KeyError(f"job not found: {job_id}")
+            return self.jobs[job_id]
+
+    def cancel(self, job_id: str):
+        """Cancel job by id. Queued jobs are dropped, the running job is interrupted
+        once its generation has begun (see `begin_generation`).
+
+        Args:
+            job_id (str): Id of job.
+
+        Returns:
+            Job: Job.
+        """
+        job = self.get(job_id)
+        with self.lock:
+            if job.is_finished:
+                return job
+            job.cancelled = True
+            if job.status == JOB_QUEUED:
+                job.future.cancel()
+                job.status = JOB_CANCELLED
+                job.finished_at = time.monotonic()
+            elif job.generating:
+                # generation can't end (and another begin) while the lock is held
+                shared.state.interrupt()
+        return job
+
+
+jobs = JobStore()
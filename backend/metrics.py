@@ -0,0 +1,160 @@
+"""
+Low-overhead timers for the stages of requests, reported per request as a
+`Server-Timing` header and aggregated into Prometheus-style metrics.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Tuple
+
+from fastapi import Request
+
+from .config import METRICS_BUCKETS, ROUTE_PREFIX
+
+# (stage, seconds) timed during the current request, None outside of requests
+_request_timings: ContextVar[List[Tuple[str, float]]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = METRICS_BUCKETS):
+        """Histogram of observed values, like Prometheus' histograms.
+
+        Args:
+            buckets (tuple, optional): Sorted upper bounds of buckets. Defaults to METRICS_BUCKETS.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str):
+        """Render as lines of the Prometheus text format."""
+        lines, total = [], 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        """Aggregated timings of stages & requests since startup."""
+        self.lock = threading.Lock()
+        self.stages: Dict[str, Histogram] = {}
+        self.requests: Dict[str, Histogram] = {}
+        self.statuses: Dict[Tuple[str, int], int] = {}
+
+    def observe_stage(self, name: str, seconds: float):
+        with self.lock:
+            self.stages.setdefault(name, Histogram()).observe(seconds)
+
+    def observe_request(self, route: str, status: int, seconds: float):
+        with self.lock:
+            self.requests.setdefault(route, Histogram()).observe(seconds)
+            key = (route, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def render(self):
+        """Render metrics in the Prometheus text format.
+
+        Returns:
+            str: Metrics.
+        """
+        with self.lock:
+            lines = [
+                "# HELP sd_paint_stage_seconds Time spent in each stage of requests.",
+                "# TYPE sd_paint_stage_seconds histogram",
+            ]
+            for name, hist in sorted(self.stages.items()):
+                lines += hist.render("sd_paint_stage_seconds", f'stage="{name}"')
+            lines += [
+                "# HELP sd_paint_request_seconds Time until response headers are sent.",
+                "# TYPE sd_paint_request_seconds histogram",
+            ]
+            for route, hist in sorted(self.requests.items()):
+                lines += hist.render("sd_paint_request_seconds", f'route="{route}"')
+            lines += [
+                "# HELP sd_paint_requests_total Requests by route & status code.",
+                "# TYPE sd_paint_requests_total counter",
+            ]
+            for (route, status), count in sorted(self.statuses.items()):
+                labels = f'route="{route}",status="{status}"'
+                lines.append(f"sd_paint_requests_total{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage of the current request.
+
+    Args:
+        name (str): Name of stage. Repeated stages are summed in `Server-Timing`.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe_stage(name, seconds)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, seconds))
+
+
+def format_server_timing(timings: List[Tuple[str, float]], total: float):
+    """Format timings as a `Server-Timing` header.
+
+    Args:
+        timings (List[Tuple[str, float]]): (stage, seconds) in order.
+        total (float): Seconds taken by the whole request.
+
+    Returns:
+        str: Header value, i.e. `decode;dur=1.2, total;dur=3.4` (in ms).
+    """
+    durations: Dict[str, float] = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations["total"] = total
+    return ", ".join(f"{k};dur={v * 1000:.1f}" for k, v in durations.items())
+
+
+async def app_timing_middleware(req: Request, call_next):
+    """Used to time requests to our routes & add the `Server-Timing` header.
+
+    For streamed responses, only stages done before the first frame count.
+    """
+    if not req.url.path.startswith(ROUTE_PREFIX):
+        return await call_next(req)
+
+    timings = []
+    token = _request_timings.set(timings)
+    start = time.perf_counter()
+    status = 500
+    try:
+        res = await call_next(req)
+        status = res.status_code
+    finally:
+        _request_timings.reset(token)
+        total = time.perf_counter() - start
+        # use route template so ids in paths (i.e. jobs) don't explode cardinality
+        route = getattr(req.scope.get("route"), "path", "unmatched")
+        metrics.observe_request(route, status, total)
+
+    res.headers["Server-Timing"] = format_server_timing(timings, total)
+    return res
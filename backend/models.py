@@ -0,0 +1,90 @@
+"""
+Keeps track of which checkpoint & VAE are resident so that requests only pay
+for a reload when the selection actually changes.
+"""
+from __future__ import annotations
+
+import logging
+
+import modules
+from modules import shared
+
+from .config import LOGGER_NAME
+
+log = logging.getLogger(LOGGER_NAME)
+
+# (requested vae, checkpoint it was applied to, vae file webUI reported afterwards)
+_vae_state = None
+
+
+def get_loaded_checkpoint():
+    """Get info about the checkpoint currently loaded by the webUI.
+
+    Returns:
+        Union[CheckpointInfo, None]: Loaded checkpoint info if any.
+    """
+    return getattr(shared.sd_model, "sd_checkpoint_info", None)
+
+
+def ensure_checkpoint(name: str, cache_size: int = None):
+    """Load checkpoint by name, unless it is already the loaded checkpoint.
+
+    Recently used checkpoints are kept in RAM by the webUI's own checkpoint cache
+    (`sd_checkpoint_cache`), so switching back to one of them is a memory copy
+    instead of a disk load. `cache_size` sets how many are kept. Cached text
+    conditioning (see `cond_cache`) is dropped when the checkpoint changes.
+
+    Args:
+        name (str): Title of checkpoint, as given by `checkpoint_tiles()`.
+        cache_size (int, optional): Number of checkpoints to keep in RAM, overriding
+            the webUI's `sd_checkpoint_cache` setting. Defaults to None (unchanged).
+
+    Returns:
+        bool: Whether the checkpoint had to be (re)loaded.
+    """
+    # only touch the webUI's own setting when asked to change it
+    if cache_size is not None and cache_size >= 0:
+        if shared.opts.sd_checkpoint_cache != cache_size:
+            shared.opts.sd_checkpoint_cache = cache_size
+
+    shared.opts.sd_model_checkpoint = name
+    info = modules.sd_models.get_closet_checkpoint_match(name)
+    loaded = get_loaded_checkpoint()
+    if info is not None and loaded is not None and info.filename == loaded.filename:
+        return False
+
+    if info is None:
+        log.warning(f"checkpoint not found: {name}, webUI will pick a fallback")
+    else:
+        log.info(f"loading checkpoint: {info.title}")
+    modules.sd_models.reload_model_weights(shared.sd_model, info)
+    # imported here as cond_cache depends on this module
+    from .cond_cache import cond_cache
+
+    # conditioning of the previous model would only hold on to VRAM
+    cond_cache.clear()
+    return True
+
+
+def ensure_vae(name: str):
+    """Apply VAE by name, unless it is already applied to the loaded checkpoint.
+
+    Args:
+        name (str): Name of VAE, or "Automatic"/"None".
+
+    Returns:
+        bool: Whether the VAE had to be (re)loaded.
+    """
+    global _vae_state
+    shared.opts.sd_vae = name
+
+    loaded = get_loaded_checkpoint()
+    ckpt = None if loaded is None else loaded.filename
+    state = (name, ckpt, getattr(modules.sd_vae, "loaded_vae_file", None))
+    # the webUI can swap the VAE behind our back, hence loaded_vae_file is compared too
+    if state == _vae_state:
+        return False
+
+    modules.sd_vae.reload_vae_weights()
+    _vae_state = (name, ckpt, getattr(modules.sd_vae, "loaded_vae_file", None))
+    return True
@@ -0,0 +1,189 @@
+"""
+Runs generation by building the webUI's processing objects directly, instead of
+calling its Gradio handlers through `wrap_gradio_gpu_call` with positional args.
+"""
+from __future__ import annotations
+
+from typing import Dict
+
+import modules
+from modules import shared
+from modules.call_queue import queue_lock
+from modules.processing import (
+    StableDiffusionProcessing,
+    StableDiffusionProcessingImg2Img,
+    StableDiffusionProcessingTxt2Img,
+    process_images,
+)
+from PIL import Image
+
+from .cond_cache import cond_cache
+from .jobs import jobs
+from .utils import get_sampler_index, parse_prompt
+
+
+def get_sampler_name(sampler_name: str):
+    """Get canonical name of sampler by name or alias."""
+    return modules.sd_samplers.samplers[get_sampler_index(sampler_name)].name
+
+
+def create_txt2img(req, width: int, height: int):
+    """Create processing object for Txt2Img, like the webUI's txt2img tab does.
+
+    Args:
+        req (DefaultTxt2ImgOptions): Request with defaults already merged.
+        width (int): Width to generate at.
+        height (int): Height to generate at.
+
+    Returns:
+        StableDiffusionProcessingTxt2Img: Processing object.
+    """
+    opts = shared.opts
+    return StableDiffusionProcessingTxt2Img(
+        sd_model=shared.sd_model,
+        outpath_samples=opts.outdir_samples or opts.outdir_txt2img_samples,
+        outpath_grids=opts.outdir_grids or opts.outdir_txt2img_grids,
+        prompt=parse_prompt(req.prompt),
+        negative_prompt=parse_prompt(req.negative_prompt),
+        seed=req.seed,
+        subseed=req.subseed,
+        subseed_strength=req.subseed_strength,
+        seed_resize_from_h=req.seed_resize_from_h,
+        seed_resize_from_w=req.seed_resize_from_w,
+        seed_enable_extras=req.seed_enable_extras,
+        sampler_name=get_sampler_name(req.sampler_name),
+        batch_size=req.batch_size,
+        n_iter=req.batch_count,
+        steps=req.steps,
+        cfg_scale=req.cfg_scale,
+        width=width,
+        height=height,
+        restore_faces=req.restore_faces,
+        tiling=req.tiling,
+        enable_hr=req.highres_fix,
+        # only applicable if high res fix in use
+        denoising_strength=req.denoising_strength if req.highres_fix else None,
+        hr_scale=0,  # overrided by hr_resize_x/y
+        hr_upscaler=req.upscaler_name,
+        hr_second_pass_steps=0,  # 0 uses same num of steps as generation
+        hr_resize_x=req.orig_width,
+        hr_resize_y=req.orig_height,
+    )
+
+
+def create_img2img(req, image: Image.Image, mask: Image.Image, width: int, height: int):
+    """Create processing object for Img2Img/Inpaint, like the webUI's img2img
+    tab does in its "img2img" & "inpaint upload" modes.
+
+    Args:
+        req (DefaultImg2ImgOptions): Request with defaults already merged.
+        image (Image): Source image.
+        mask (Image): Luminance mask. Only used for inpainting.
+        width (int): Width to generate at.
+        height (int): Height to generate at.
+
+    Returns:
+        StableDiffusionProcessingImg2Img: Processing object.
+    """
+    opts = shared.opts
+    return StableDiffusionProcessingImg2Img(
+        sd_model=shared.sd_model,
+        outpath_samples=opts.outdir_samples or opts.outdir_img2img_samples,
+        outpath_grids=opts.outdir_grids or opts.outdir_img2img_grids,
+        prompt=parse_prompt(req.prompt),
+        negative_prompt=parse_prompt(req.negative_prompt),
+        seed=req.seed,
+        subseed=req.subseed,
+        subseed_strength=req.subseed_strength,
+        seed_resize_from_h=req.seed_resize_from_h,
+        seed_resize_from_w=req.seed_resize_from_w,
+        seed_enable_extras=req.seed_enable_extras,
+        sampler_name=get_sampler_name(req.sampler_name),
+        batch_size=req.batch_size,
+        n_iter=req.batch_count,
+        steps=req.steps,
+        cfg_scale=req.cfg_scale,
+        width=width,
+        height=height,
+        restore_faces=req.restore_faces,
+        tiling=req.tiling,
+        init_images=[image],
+        mask=mask if req.is_inpaint else None,
+        mask_blur=0,  # req.mask_blur
+        inpainting_fill=req.inpainting_fill,
+        resize_mode=req.resize_mode,
+        denoising_strength=req.denoising_strength,
+        # region around mask is cropped by us instead, see `run_img2img`
+        inpaint_full_res=False,
+        inpaint_full_res_padding=0,
+        inpainting_mask_invert=req.invert_mask,
+    )
+
+
+class Pipeline:
+    def __init__(
+        self,
+        p: StableDiffusionProcessing,
+        runner: modules.scripts.ScriptRunner,
+        script: modules.scripts.Script = None,
+        script_args: list = None,
+    ):
+        """Processing object ready to run, with the selected script if any.
+
+        Only the selected script's own arguments are needed, as its `run` is
+        called directly. Always-on scripts get no arguments, same as when no
+        script is selected in the webUI's API.
+
+        The processing object can be run several times with different seeds
+        (i.e. consecutive batches of one request), see `run`. Call `close` once
+        done with it.
+
+        Args:
+            p (StableDiffusionProcessing): Processing object.
+            runner (ScriptRunner): `scripts_txt2img` or `scripts_img2img`.
+            script (Script, optional): Selected script. Defaults to None.
+            script_args (list, optional): Arguments of selected script. Defaults to None.
+        """
+        self.p = p
+        self.script = script
+        self.script_args = script_args or []
+        p.scripts = runner
+        p.script_args = ()
+
+    def run(self, **update):
+        """Run, holding the webUI's queue lock like its own routes do.
+
+        Args:
+            update: Attributes of the processing object to set first, i.e. `seed`.
+
+        Returns:
+            Tuple[List[Image], str]: Output images and jsonified info.
+        """
+        for k, v in update.items():
+            setattr(self.p, k, v)
+
+        with queue_lock:
+            shared.state.begin()
+            jobs.begin_generation()
+            try:
+                with cond_cache.use(self.p):
+                    processed = None
+                    if self.script is not None:
+                        processed = self.script.run(self.p, *self.script_args)
+                    if processed is None:
+                        processed = process_images(self.p)
+            finally:
+                jobs.end_generation()
+                shared.state.end()
+                shared.total_tqdm.clear()
+        return processed.images, processed.js()
+
+    def close(self):
+        self.p.close()
+
+
+def close_pipelines(pipes: Dict[str, Pipeline]):
+    """Close pipelines kept for reuse."""
+    for pipe in pipes.values():
+        pipe.close()
+    pipes.clear()
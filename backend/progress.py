@@ -0,0 +1,146 @@
+"""
+Pushes generation progress to subscribers as it changes, so clients don't have
+to poll the webUI's progress API (which resends the preview every time).
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from io import BytesIO
+
+from modules import shared
+from starlette.concurrency import run_in_threadpool
+
+from PIL import Image
+
+from .config import PROGRESS_IDLE_TIMEOUT, PROGRESS_INTERVAL
+from .utils import pack_frame
+
+PREVIEW_FORMATS = {"jpeg": "JPEG", "webp": "WEBP"}
+
+# (preview image, its frame id, {(size, format, quality): encoding}) shared by all subscribers
+_preview_cache = (None, 0, {})
+# subscribers encode in the threadpool, so replacing the cache must be atomic
+_preview_lock = threading.Lock()
+
+
+def get_progress():
+    """Get progress, computed the same way as the webUI's progress API.
+
+    Returns:
+        Dict: Progress, ETA in seconds and state of the webUI.
+    """
+    state = shared.state
+    progress = 0.01
+    if state.job_count > 0:
+        progress += state.job_no / state.job_count
+        if state.sampling_steps > 0:
+            progress += state.sampling_step / state.sampling_steps / state.job_count
+    progress = min(progress, 1)
+
+    elapsed = time.time() - state.time_start if state.time_start else 0
+    return {
+        "progress": progress,
+        "eta_relative": elapsed / progress - elapsed,
+        "state": state.dict(),
+    }
+
+
+def get_preview():
+    """Update the live preview if it is due & get it.
+
+    Returns:
+        Union[Image, None]: Live preview if any.
+    """
+    if getattr(shared.opts, "live_previews_enable", True):
+        shared.state.set_current_image()
+    return shared.state.current_image
+
+
+def encode_preview(image: Image.Image, size: int, fmt: str, quality: int):
+    """Downscale & encode live preview, reusing the encoding if another
+    subscriber already asked for the same one.
+
+    Args:
+        image (Image): Live preview.
+        size (int): Max width & height of thumbnail, 0 for full size.
+        fmt (str): Key of `PREVIEW_FORMATS`.
+        quality (int): Quality from 1 to 100.
+
+    Returns:
+        Tuple[int, bytes]: Frame id of preview & encoded thumbnail.
+    """
+    global _preview_cache
+    with _preview_lock:
+        if _preview_cache[0] is not image:
+            _preview_cache = (image, _preview_cache[1] + 1, {})
+        _, frame_id, encodings = _preview_cache
+
+    key = (size, fmt, quality)
+    if key not in encodings:
+        thumb = image.convert("RGB")
+        if size > 0:
+            thumb.thumbnail((size, size))
+        buf = BytesIO()
+        thumb.save(buf, PREVIEW_FORMATS[fmt], quality=quality)
+        encodings[key] = buf.getvalue()
+    return frame_id, encodings[key]
+
+
+async def stream_progress(
+    size: int = 0,
+    fmt: str = "jpeg",
+    quality: int = 80,
+    interval: float = PROGRESS_INTERVAL,
+    idle_timeout: float = PROGRESS_IDLE_TIMEOUT,
+):
+    """Yield progress as frames (see `pack_frame`) whenever it changes.
+
+    Frames have the same keys as the webUI's progress API, except the live
+    preview is sent as `preview`, a thumbnail encoded as `fmt`, along with its
+    `preview_id`. The thumbnail is only sent when the preview changed, and is
+    None otherwise. The stream ends once no job has run for `idle_timeout`
+    seconds.
+
+    Args:
+        size (int, optional): Max width & height of preview, 0 for full size. Defaults to 0.
+        fmt (str, optional): Format of preview, see `PREVIEW_FORMATS`. Defaults to "jpeg".
+        quality (int, optional): Quality of preview from 1 to 100. Defaults to 80.
+        interval (float, optional): Seconds between checks for changes. Defaults to PROGRESS_INTERVAL.
+        idle_timeout (float, optional): Seconds idle before ending. Defaults to PROGRESS_IDLE_TIMEOUT.
+
+    Yields:
+        bytes: Frame.
+    """
+    last_step, last_image, preview_id = None, None, 0
+    idle_since = time.monotonic()
+    while True:
+        state = shared.state
+        if state.job_count == 0:
+            if time.monotonic() - idle_since > idle_timeout:
+                break
+            await asyncio.sleep(interval)
+            continue
+        idle_since = time.monotonic()
+
+        step = (
+            state.job,
+            state.job_no,
+            state.job_count,
+            state.sampling_step,
+            state.sampling_steps,
+        )
+        image = await run_in_threadpool(get_preview)
+        is_new_image = image is not None and image is not last_image
+        if step != last_step or is_new_image:
+            enc = None
+            if is_new_image:
+                preview_id, enc = await run_in_threadpool(
+                    encode_preview, image, size, fmt, quality
+                )
+            yield pack_frame(
+                {**get_progress(), "preview": enc, "preview_id": preview_id}
+            )
+            last_step, last_image = step, image
+        await asyncio.sleep(interval)
@@ -0,0 +1,113 @@
+"""
+Constant time lookup of samplers, upscalers & scripts by name, instead of
+scanning the webUI's lists on every request.
+"""
+from __future__ import annotations
+
+from difflib import get_close_matches
+from typing import Any, Callable, Dict, Iterable, Sequence
+
+import modules
+from modules import shared
+
+
+def lookup(index: Dict[Any, int], name: Any, kind: str):
+    """Get index by name, raising an error listing the nearest names if missing.
+
+    Args:
+        index (Dict[Any, int]): Index by name.
+        name (Any): Name to look up.
+        kind (str): What is being looked up, for the error message.
+
+    Raises:
+        KeyError: Name cannot be found.
+
+    Returns:
+        int: Index.
+    """
+    try:
+        return index[name]
+    except (KeyError, TypeError):
+        pass
+    nearest = get_close_matches(str(name), [str(n) for n in index], n=3, cutoff=0.5)
+    hint = f", did you mean: {', '.join(nearest)}?" if nearest else ""
+    raise KeyError(f"{kind} not found: {name}{hint}")
+
+
+class NameIndex:
+    def __init__(
+        self,
+        kind: str,
+        get_items: Callable[[], Sequence],
+        get_names: Callable[[Any], Iterable[str]],
+    ):
+        """Index of a list owned by the webUI, by the name(s) of each item.
+
+        The index is rebuilt when the list is replaced or changes length. Hits
+        are checked against the item they point to and misses are retried once
+        after a rebuild, so in-place edits of the list are picked up too.
+
+        Args:
+            kind (str): What the items are, for error messages.
+            get_items (Callable[[], Sequence]): Get the current list.
+            get_names (Callable[[Any], Iterable[str]]): Get names of an item. If
+                several items share a name, the first one wins.
+        """
+        self.kind = kind
+        self.get_items = get_items
+        self.get_names = get_names
+        self.key = None
+        self.index: Dict[str, int] = {}
+
+    def build(self, items: Sequence):
+        index = {}
+        for i, item in enumerate(items):
+            for name in self.get_names(item):
+                index.setdefault(name, i)
+        self.index, self.key = index, (id(items), len(items))
+
+    def is_hit(self, items: Sequence, i: int, name: str):
+        return i is not None and i < len(items) and name in self.get_names(items[i])
+
+    def get(self, name: str):
+        """Get index of item by name.
+
+        Args:
+            name (str): Exact name of item.
+
+        Raises:
+            KeyError: Item cannot be found.
+
+        Returns:
+            int: Index of item.
+        """
+        items = self.get_items()
+        if self.key != (id(items), len(items)):
+            self.build(items)
+        i = self.index.get(name)
+        if not self.is_hit(items, i, name):
+            self.build(items)
+        return lookup(self.index, name, self.kind)
+
+
+sampler_index = NameIndex(
+    "sampler",
+    lambda: modules.sd_samplers.samplers,
+    lambda sampler: [sampler.name, *sampler.aliases],
+)
+upscaler_index = NameIndex(
+    "upscaler", lambda: shared.sd_upscalers, lambda upscaler: [upscaler.name]
+)
+script_indexes = {
+    False: NameIndex(
+        "txt2img script",
+        lambda: modules.scripts.scripts_txt2img.titles,
+        lambda title: [title],
+    ),
+    True: NameIndex(
+        "img2img script",
+        lambda: modules.scripts.scripts_img2img.titles,
+        lambda title: [title],
+    ),
+}
+"""is_img2img -> index of scripts (without "None")"""
@@ -0,0 +1,169 @@
+"""
+On-disk cache of generation results for requests with a fixed seed, so re-running
+the exact same settings doesn't touch the GPU.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+import modules
+from PIL import Image
+from pydantic import BaseModel
+
+from .config import LOGGER_NAME, RESULT_CACHE_PATH, RESULT_CACHE_SIZE
+from .models import get_loaded_checkpoint
+from .utils import (
+    bytes_to_img,
+    get_offsets,
+    img_to_bytes,
+    pack_parts,
+    unpack_parts,
+)
+
+log = logging.getLogger(LOGGER_NAME)
+
+# options that don't affect the generated images, and source images, which are
+# hashed once decoded so the key doesn't depend on their encoding or transport
+EXCLUDED_OPTIONS = {
+    "sample_path",
+    "save_samples",
+    "output_format",
+    "checkpoint_cache",
+    "src_img",
+    "mask_img",
+    "src_imgs",
+}
+
+
+class ResultCache:
+    def __init__(
+        self, path: str = RESULT_CACHE_PATH, max_size: int = RESULT_CACHE_SIZE
+    ):
+        """Size-bounded, content-addressed store of results with LRU eviction.
+
+        Each entry is a single file (see `pack_parts`) named by the hash of the
+        request, source images, model & VAE. File modification times track
+        recency so the LRU order survives restarts.
+
+        Args:
+            path (str, optional): Folder to store results in. Defaults to RESULT_CACHE_PATH.
+            max_size (int, optional): Max total size in bytes, 0 disables. Defaults to RESULT_CACHE_SIZE.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = None  # key -> size, oldest first; loaded lazily
+        self.size = 0
+
+    def load(self):
+        """Index existing entries on disk."""
+        os.makedirs(self.path, exist_ok=True)
+        files = []
+        for name in os.listdir(self.path):
+            stat = os.stat(os.path.join(self.path, name))
+            files.append((stat.st_mtime, name, stat.st_size))
+        self.entries = OrderedDict((name, size) for _, name, size in sorted(files))
+        self.size = sum(self.entries.values())
+
+    def is_cacheable(self, req: BaseModel):
+        """Only requests with a fixed seed are deterministic."""
+        if self.max_size <= 0 or not isinstance(req.seed, int) or req.seed == -1:
+            return False
+        return not (req.seed_enable_extras and req.subseed == -1)
+
+    def get_key(self, req: BaseModel, *images: Image.Image):
+        """Get key of request. Loaded model & VAE are used so call after `prepare_backend`.
+
+        Args:
+            req (BaseModel): Request with defaults already merged.
+            images (Image): Source images (i.e. image & mask) if any.
+
+        Returns:
+            str: Key.
+        """
+        info = get_loaded_checkpoint()
+        h = hashlib.sha256()
+        h.update(
+            json.dumps(
+                {
+                    "req": req.dict(exclude=EXCLUDED_OPTIONS),
+                    "model": getattr(info, "title", None),
+                    "vae": getattr(modules.sd_vae, "loaded_vae_file", None),
+                },
+                sort_keys=True,
+                default=str,
+            ).encode("utf-8")
+        )
+        for image in images:
+            if image is None:
+                h.update(b"None")
+                continue
+            h.update(f"{image.mode}:{image.width}x{image.height}".encode("utf-8"))
+            h.update(image.tobytes())
+        return h.hexdigest()
+
+    def get(self, key: str):
+        """Get result by key.
+
+        Args:
+            key (str): Key.
+
+        Returns:
+            Union[Tuple[List[Image], str], None]: Output images and info if cached.
+        """
+        with self.lock:
+            if self.entries is None:
+                self.load()
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            path = os.path.join(self.path, key)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                self.size -= self.entries.pop(key)
+                return None
+        obj = unpack_parts(data)
+        images = [bytes_to_img(o) for o in obj["outputs"]]
+        for image, offset in zip(images, obj.get("offsets") or []):
+            image.info["offset"] = tuple(offset)
+        return images, obj["info"]
+
+    def put(self, key: str, images: List[Image.Image], info: str):
+        """Store result, evicting least recently used results if over size.
+
+        Args:
+            key (str): Key.
+            images (List[Image]): Output images.
+            info (str): Generation info.
+        """
+        outputs = [img_to_bytes(image, "png_fast") for image in images]
+        offsets = get_offsets(images)
+        data = pack_parts({"outputs": outputs, "info": info, "offsets": offsets})
+        with self.lock:
+            if self.entries is None:
+                self.load()
+            if key in self.entries:
+                self.size -= self.entries.pop(key)
+            with open(os.path.join(self.path, key), "wb") as f:
+                f.write(data)
+            self.entries[key] = len(data)
+            self.size += len(data)
+            while self.size > self.max_size and self.entries:
+                old, size = self.entries.popitem(last=False)
+                self.size -= size
+                try:
+                    os.remove(os.path.join(self.path, old))
+                except OSError:
+                    pass
+
+
+result_cache = ResultCache()
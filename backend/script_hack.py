@@ -3,19 +3,29 @@ Attempting to map Gradio UI elements present in scripts to allow
 converting to pyQt elements on the plugin side.
 """
 
+import hashlib
+import json
 import logging
-from typing import List, Sequence, Tuple
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional, Sequence, Tuple
 
-import gradio as gr
 import modules
 
 from .config import LOGGER_NAME
+from .registry import lookup, script_indexes
 
 log = logging.getLogger(LOGGER_NAME)
 
+# held while inspecting scripts in the background, see `warm_scripts_metadata`
+_warm_lock = threading.Lock()
+
 
 def inspect_ui(script: modules.scripts.Script, is_img2img: bool):
     """Get metadata about accepted arguments by inspecting GUI. Needs Gradio Blocks context."""
+    import gradio as gr
+
     elems = script.ui(is_img2img)
 
     metadata = []
@@ -75,44 +85,191 @@ def inspect_ui(script: modules.scripts.Script, is_img2img: bool):
     return metadata
 
 
-img2img_script_meta = None
-txt2img_script_meta = None
+def index_opts(opts: Sequence[str]):
+    """Index of options by value. Like `list.index`, the first of duplicates wins."""
+    index = {}
+    for i, v in enumerate(opts):
+        index.setdefault(v, i)
+    return index
 
 
-def get_scripts_metadata(is_img2img: bool):
-    """Get metadata about accepted arguments for scripts."""
-    # NOTE: inspect_ui is quite slow, so cache this
-    global txt2img_script_meta, img2img_script_meta
-    if is_img2img:
-        runner = modules.scripts.scripts_img2img
-    else:
-        runner = modules.scripts.scripts_txt2img
-    metadata = {"None": []}
-    # Check if cache is still valid
-    if (
-        is_img2img
-        and img2img_script_meta
-        and len(img2img_script_meta) - 1 == len(runner.titles)
-    ):
-        return img2img_script_meta
-    elif txt2img_script_meta and len(txt2img_script_meta) - 1 == len(runner.titles):
-        return txt2img_script_meta
-
-    # NOTE: scripts are loaded before our extension is registered so metadata should be valid
-    with gr.Blocks(visible=False, analytics_enabled=False):
-        for name, script in zip(runner.titles, runner.selectable_scripts):
-            metadata[name] = inspect_ui(script, is_img2img)
-    if is_img2img:
-        img2img_script_meta = metadata
-    else:
-        txt2img_script_meta = metadata
-    return metadata
+class ScriptMetaCache:
+    def __init__(self):
+        """Metadata about accepted arguments of scripts, kept per script so only
+        scripts that were added or reloaded since are re-inspected, as
+        `inspect_ui` is quite slow.
+
+        Entries are keyed by title & versioned by the script instance itself;
+        the webUI creates new instances when it reloads scripts, so those are
+        re-inspected. The metadata of all scripts is also kept as JSON, ready to
+        be sent by `/config`.
+        """
+        self.lock = threading.Lock()
+        """Held while scripts are being inspected."""
+        self.entries: Dict[Tuple[bool, str], tuple] = {}
+        """(is_img2img, title) -> (weakref to script, metadata, index of options per argument)"""
+        self.results: Dict[bool, tuple] = {}
+        """is_img2img -> (metadata of all scripts, JSON of it, digest of JSON)"""
+        self.ready = threading.Event()
+        """Set once both txt2img & img2img scripts have been inspected."""
+
+    def invalidate(self):
+        """Forget all metadata, so every script is re-inspected on next use.
+
+        The last results are kept, to be served while that happens.
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def get(self, is_img2img: bool, wait: bool = True):
+        """Get metadata of all txt2img or img2img scripts, inspecting those
+        that changed.
+
+        Args:
+            is_img2img (bool): Whether to get metadata for img2img or txt2img scripts.
+            wait (bool, optional): Whether to wait for scripts to be inspected.
+                If not, scripts are never inspected by the caller; the last
+                results are returned instead & changed scripts are inspected
+                in the background (see `warm_scripts_metadata`). Defaults to True.
+
+        Returns:
+            Union[Tuple[Dict[str, List[dict]], str, str], None]: Metadata by
+            script name, its JSON & digest of the JSON, or None if not waiting &
+            scripts are being inspected for the first time.
+        """
+        if wait:
+            with self.lock:
+                return self.update(is_img2img)
+
+        if self.lock.acquire(blocking=False):
+            try:
+                scripts, stale = self.get_stale(is_img2img)
+                if not stale and self.is_current(is_img2img, scripts):
+                    return self.results[is_img2img]
+            finally:
+                self.lock.release()
+            # inspecting is slow & may be called from the event loop
+            warm_scripts_metadata()
+        return self.results.get(is_img2img) if self.ready.is_set() else None
+
+    def get_stale(self, is_img2img: bool):
+        """Get scripts of the webUI & those that need to be (re)inspected."""
+        if is_img2img:
+            runner = modules.scripts.scripts_img2img
+        else:
+            runner = modules.scripts.scripts_txt2img
+        scripts = list(zip(runner.titles, runner.selectable_scripts))
+        stale = []
+        for name, script in scripts:
+            entry = self.entries.get((is_img2img, name))
+            if entry is None or entry[0]() is not script:
+                stale.append((name, script))
+        return scripts, stale
+
+    def is_current(self, is_img2img: bool, scripts: list):
+        """Whether the last result has exactly `scripts`."""
+        result = self.results.get(is_img2img)
+        titles = [name for name, _ in scripts]
+        return result is not None and list(result[0])[1:] == titles
+
+    def update(self, is_img2img: bool):
+        scripts, stale = self.get_stale(is_img2img)
+        if not stale and self.is_current(is_img2img, scripts):
+            return self.results[is_img2img]
+
+        titles = [name for name, _ in scripts]
+        if stale:
+            # only imported here as importing gradio is slow
+            import gradio as gr
+
+            # NOTE: scripts are loaded before our extension is registered so metadata should be valid
+            with gr.Blocks(visible=False, analytics_enabled=False):
+                for name, script in stale:
+                    log.info(f"inspecting script: {name}")
+                    meta = inspect_ui(script, is_img2img)
+                    opt_index = [
+                        index_opts(o["opts"]) if o["is_index"] else None for o in meta
+                    ]
+                    entry = (weakref.ref(script), meta, opt_index)
+                    self.entries[(is_img2img, name)] = entry
+
+        # drop scripts that no longer exist
+        for key in [k for k in self.entries if k[0] == is_img2img]:
+            if key[1] not in titles:
+                del self.entries[key]
+
+        metadata = {"None": []}
+        for name in titles:
+            metadata[name] = self.entries[(is_img2img, name)][1]
+        blob = json.dumps(metadata)
+        digest = hashlib.sha1(blob.encode("utf-8")).hexdigest()
+        result = self.results[is_img2img] = (metadata, blob, digest)
+        if len(self.results) == 2:
+            self.ready.set()
+        return result
+
+    def get_opt_index(self, is_img2img: bool, name: str):
+        """Get index of options by value for each argument of a script, for
+        arguments given as an index into their options (i.e. dropdowns).
+
+        Args:
+            is_img2img (bool): Whether the script is for img2img or txt2img.
+            name (str): Exact name of script.
+
+        Returns:
+            List[Union[Dict[str, int], None]]: Index of options per argument, or
+            None for arguments that aren't an index.
+        """
+        with self.lock:
+            self.update(is_img2img)
+            return self.entries[(is_img2img, name)][2]
+
+
+script_meta = ScriptMetaCache()
+
+
+def get_scripts_metadata(is_img2img: bool, wait: bool = True):
+    """Get metadata about accepted arguments for scripts. See `ScriptMetaCache.get`.
+
+    Args:
+        is_img2img (bool): Whether to get metadata for img2img or txt2img scripts.
+        wait (bool, optional): Whether to wait if scripts are being inspected
+            elsewhere (see `warm_scripts_metadata`). Defaults to True.
+
+    Returns:
+        Union[Dict[str, List[dict]], None]: Metadata by script name, or None if
+        not waiting & scripts are being inspected for the first time.
+    """
+    result = script_meta.get(is_img2img, wait)
+    return None if result is None else result[0]
+
+
+def warm_scripts_metadata():
+    """Inspect scripts in a background thread, so `/config` doesn't have to
+    wait on it. Does nothing if already inspecting in the background.
+    """
+    if not _warm_lock.acquire(blocking=False):
+        return
+
+    def warm():
+        start = time.monotonic()
+        try:
+            get_scripts_metadata(False)
+            get_scripts_metadata(True)
+        except Exception:
+            log.exception("failed to inspect scripts")
+            return
+        finally:
+            _warm_lock.release()
+        log.info(f"inspected scripts in {time.monotonic() - start:.2f}s")
+
+    threading.Thread(target=warm, name="sd_paint_script_meta", daemon=True).start()
 
 
 def get_script_info(
     script_name: str, is_img2img: bool
-) -> Tuple[int, modules.scripts.Script, List[dict]]:
-    """Get index of script, script instance and argument metadata by name.
+) -> Tuple[int, modules.scripts.Script, List[Optional[Dict[str, int]]]]:
+    """Get index of script, script instance and index of its options by name.
 
     Args:
         script_name (str): Exact name of script.
@@ -122,42 +279,48 @@ def get_script_info(
         KeyError: Script cannot be found.
 
     Returns:
-        Tuple[int, Script, List[dict]]: Index of script, script itself and arguments metadata.
+        Tuple[int, Script, List[Union[Dict[str, int], None]]]: Index of script,
+        script itself and index of options per argument (see `ScriptMetaCache.get_opt_index`).
     """
     if is_img2img:
         runner = modules.scripts.scripts_img2img
     else:
         runner = modules.scripts.scripts_txt2img
-    # in API, index 0 means no script, scripts are indexed from 1 onwards
-    names = ["None"] + runner.titles
     if script_name == "None":
         return 0, None, []
-    for i, n in enumerate(names):
-        if n == script_name:
-            script = runner.selectable_scripts[i - 1]
-            return i, script, get_scripts_metadata(is_img2img)[n]
-    raise KeyError(f"script not found for type {type}: {script_name}")
+    i = script_indexes[is_img2img].get(script_name)
+    script = runner.selectable_scripts[i]
+    # in API, index 0 means no script, scripts are indexed from 1 onwards
+    return i + 1, script, script_meta.get_opt_index(is_img2img, script_name)
 
 
 def process_script_args(
-    script_ind: int, script: modules.scripts.Script, meta: List[dict], args: list
+    script: modules.scripts.Script,
+    opt_index: List[Optional[Dict[str, int]]],
+    args: list,
 ) -> list:
-    """Get the position arguments required."""
+    """Get the arguments of the selected script, converting options given by
+    value back to indexes where the script expects an index.
+
+    Args:
+        script (Script): Selected script, or None.
+        opt_index (List[Union[Dict[str, int], None]]): Index of options per argument, see `get_script_info`.
+        args (list): Arguments from request.
+
+    Returns:
+        list: Arguments for the script's `run`.
+    """
     if script is None:
-        return [0]  # 0th element selects which script to use. 0 is None.
+        return []
 
     # convert strings back to indexes
-    for i, (o, arg) in enumerate(zip(meta, args)):
-        if o["is_index"]:
+    for i, (index, arg) in enumerate(zip(opt_index, args)):
+        if index is not None:
+            kind = f"option of {script.title()}"
             if isinstance(arg, list):
-                args[i] = [o["opts"].index(v) for v in arg]
+                args[i] = [lookup(index, v, kind) for v in arg]
             else:
-                args[i] = o["opts"].index(arg)
-
-    log.info(
-        f"Script selected: {script.filename}, Args Range: [{script.args_from}:{script.args_to}]"
-    )
-    # pad the args like the internal API requires...
-    args = [script_ind] + [0] * (script.args_from - 1) + args
-    log.info(f"Script args:\n{args}")
+                args[i] = lookup(index, arg, kind)
+
+    log.info(f"Script selected: {script.filename}, args:\n{args}")
     return args
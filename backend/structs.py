@@ -54,6 +54,15 @@ class UpscaleRequest(DefaultUpscaleOptions):
     """Image being used."""
 
 
+class BatchUpscaleRequest(DefaultUpscaleOptions):
+    """Batch upscale API request. If optional attributes aren't set, the defaults
+    from `krita_config.yaml` will be used.
+    """
+
+    src_imgs: List[str]
+    """Images being used."""
+
+
 class ConfigResponse(PluginOptions):
     sample_path: str
     """Where the Krita plugin should save the selected region and mask."""
@@ -80,8 +89,26 @@ class ImageResponse(BaseModel):
     """List of generated images encoded in base64."""
     info: str
     """Generation info already jsonified."""
+    offsets: Optional[List[List[int]]] = None
+    """Position [x, y] of each output in the source image if outputs were trimmed (see `trim_to_mask`)."""
 
 
 class UpscaleResponse(BaseModel):
     output: str
     """Upscaled image in base64."""
+
+
+class BatchUpscaleResponse(BaseModel):
+    outputs: List[str]
+    """Upscaled images in base64, in the same order as requested."""
+
+
+class JobResponse(BaseModel):
+    id: str
+    """Id of job."""
+    kind: str
+    """Which route the job is for."""
+    status: str
+    """One of queued, running, done, failed or cancelled."""
+    error: Optional[str] = None
+    """Error message if failed."""
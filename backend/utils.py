@@ -1,25 +1,54 @@
 from __future__ import annotations
 
+import hashlib
 import inspect
+import json
 import logging
 import os
 import secrets
+import threading
 from base64 import b64decode, b64encode
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
 from io import BytesIO
-from itertools import cycle
 from math import ceil
+from typing import Callable, List
 
-import modules
+import numpy as np
 import yaml
 from modules import shared
-from PIL import Image
+from PIL import Image, ImageChops, ImageOps
 from pydantic import BaseModel
 
-from .config import CONFIG_PATH, ENCRYPT_FILE, LOGGER_NAME, MainConfig
+from .config import (
+    CONFIG_PATH,
+    ENCRYPT_FILE,
+    LOGGER_NAME,
+    RAW_IMAGE_MAGIC,
+    SAVE_COMPRESS_LEVEL,
+    SAVE_QUEUE_SIZE,
+    SAVE_WORKERS,
+    UPSCALE_MAX_PARALLEL,
+    UPSCALE_WORKERS,
+    MainConfig,
+)
+from .models import ensure_checkpoint, ensure_vae
+from .registry import sampler_index, upscaler_index
 
 log = logging.getLogger(LOGGER_NAME)
 
 
+_config_cache = None
+# (model, type of default) -> (default, values), see `get_default_values`
+_defaults_cache = {}
+_encode_pool = None
+_save_pool = None
+_upscale_pool = None
+# held by each queued/running save, so at most SAVE_QUEUE_SIZE are pending
+_save_slots = threading.BoundedSemaphore(SAVE_QUEUE_SIZE)
+
+
 def load_config():
     """Load default config (including those not exposed in the API yet) from
     `CONFIG_PATH` in the current working directory.
@@ -27,17 +56,48 @@ def load_config():
     Will create `CONFIG_PATH` if it has yet to exist using `MainConfig` from
     `config.py`.
 
+    The parsed config is cached and only re-parsed when the file's modification
+    time or size changes. The returned object is shared, so don't modify it.
+
     Returns:
         MainConfig: config
     """
+    global _config_cache
     if not os.path.isfile(CONFIG_PATH):
         cfg = MainConfig()
         with open(CONFIG_PATH, "w") as f:
             yaml.safe_dump(cfg.dict(), f)
 
+    stat = os.stat(CONFIG_PATH)
+    key = (stat.st_mtime_ns, stat.st_size)
+    if _config_cache is not None and _config_cache[0] == key:
+        return _config_cache[1]
+
     with open(CONFIG_PATH) as file:
         obj = yaml.safe_load(file)
-        return MainConfig.parse_obj(obj)
+        cfg = MainConfig.parse_obj(obj)
+    _config_cache = (key, cfg)
+    log.info(f"loaded config from {os.path.abspath(CONFIG_PATH)}")
+    return cfg
+
+
+def get_default_values(model: type, default: BaseModel):
+    """Get values of `default` for every field of `model`, pre-merged once per
+    route (i.e. request model & config section) until the config is reloaded.
+
+    Args:
+        model (type): Model being merged into.
+        default (BaseModel): Default to merge from.
+
+    Returns:
+        dict: Default value by field name. Shared, so don't modify it.
+    """
+    key = (model, type(default))
+    cached = _defaults_cache.get(key)
+    if cached is None or cached[0] is not default:
+        values = {f: getattr(default, f, None) for f in model.__fields__}
+        cached = _defaults_cache[key] = (default, values)
+    return cached[1]
 
 
 def merge_default_config(config: BaseModel, default: BaseModel):
@@ -54,10 +114,11 @@ def merge_default_config(config: BaseModel, default: BaseModel):
     Returns:
         BaseModel: Modified config.
     """
-
-    for field in config.__fields__:
-        if not field in config.__fields_set__ or field is None:
-            setattr(config, field, getattr(default, field, None))
+    values = get_default_values(type(config), default)
+    unset = {f: v for f, v in values.items() if f not in config.__fields_set__}
+    # copy as default is shared (see `load_config`) & config may be modified later
+    config.__dict__.update(deepcopy(unset))
+    config.__fields_set__.update(unset)
 
     return config
 
@@ -68,7 +129,7 @@ def prepare_backend(opt: BaseModel):
     Currently includes:
     - Ensuring the output/input folders exist
     - Set the global face restorer model to the selected one
-    - Set the global SD model to the selected one
+    - Set the global SD model & VAE to the selected one (if not already loaded)
     - Set the global upscaler to the selected one
     - Set other misc global webUI/backend settings
 
@@ -82,12 +143,10 @@ def prepare_backend(opt: BaseModel):
         shared.opts.code_former_weight = opt.codeformer_weight
 
     if hasattr(opt, "sd_model"):
-        shared.opts.sd_model_checkpoint = opt.sd_model
-        modules.sd_models.reload_model_weights(shared.sd_model)
+        ensure_checkpoint(opt.sd_model, getattr(opt, "checkpoint_cache", None))
 
     if hasattr(opt, "sd_vae"):
-        shared.opts.sd_vae = opt.sd_vae
-        modules.sd_vae.reload_vae_weights()
+        ensure_vae(opt.sd_vae)
 
     if hasattr(opt, "clip_skip"):
         shared.opts.CLIP_stop_at_last_layers = opt.clip_skip
@@ -131,7 +190,11 @@ def optional(*fields):
 
 
 def save_img(image: Image.Image, sample_path: str, filename: str):
-    """Saves an image.
+    """Saves an image in the background.
+
+    Saves are done by a pool of writer threads. If SAVE_QUEUE_SIZE saves are
+    already pending, blocks until one is done so a slow disk can't pile up
+    images in memory. The image must not be modified afterwards.
 
     Args:
         image (Image): Image to save.
@@ -139,29 +202,76 @@ def save_img(image: Image.Image, sample_path: str, filename: str):
         filename (str): Name to save the image as.
 
     Returns:
-        str: Absolute path where the image was saved.
+        str: Absolute path where the image will be saved.
     """
+    global _save_pool
+    if _save_pool is None:
+        _save_pool = ThreadPoolExecutor(SAVE_WORKERS, thread_name_prefix="img_save")
     path = os.path.join(sample_path, filename)
-    image.save(path)
+    _save_slots.acquire()
+    future = _save_pool.submit(write_img, image, path)
+    future.add_done_callback(lambda _: _save_slots.release())
     return os.path.abspath(path)
 
 
-def img_to_b64(image: Image.Image):
+def write_img(image: Image.Image, path: str):
+    """Saves an image with fast compression, logging instead of raising errors."""
+    try:
+        image.save(path, compress_level=SAVE_COMPRESS_LEVEL)
+    except Exception:
+        log.exception(f"failed to save: {path}")
+
+
+def encode_png(image: Image.Image, buf: BytesIO):
+    """Encode as PNG at Pillow's default compression."""
+    image.save(buf, format="png")
+
+
+def encode_png_fast(image: Image.Image, buf: BytesIO):
+    """Encode as PNG with minimal compression; bigger but much faster to encode."""
+    image.save(buf, format="png", compress_level=1)
+
+
+def encode_webp_lossless(image: Image.Image, buf: BytesIO):
+    """Encode as lossless WebP using the fastest method."""
+    image.save(buf, format="webp", lossless=True, quality=0, method=0)
+
+
+def encode_raw(image: Image.Image, buf: BytesIO):
+    """Encode as raw RGBA pixels prefixed by `RAW_IMAGE_MAGIC` & 4-byte big-endian
+    width and height.
+    """
+    image = image.convert("RGBA")
+    buf.write(RAW_IMAGE_MAGIC)
+    buf.write(image.width.to_bytes(4, "big"))
+    buf.write(image.height.to_bytes(4, "big"))
+    buf.write(image.tobytes())
+
+
+IMAGE_CODECS = {
+    "png": encode_png,
+    "png_fast": encode_png_fast,
+    "webp_lossless": encode_webp_lossless,
+    "raw": encode_raw,
+}
+"""Encoders for `output_format`, add to this to support more formats."""
+
+
+def img_to_b64(image: Image.Image, fmt: str = "png"):
     """Convert an image to base64-encoded string.
 
     Args:
         image (Image): Image to encode.
+        fmt (str, optional): Name of codec in `IMAGE_CODECS`. Defaults to "png".
 
     Returns:
         str: Base64-encoded image.
     """
-    buf = BytesIO()
-    image.save(buf, format="png")
-    return b64encode(buf.getvalue()).decode("utf-8")
+    return b64encode(img_to_bytes(image, fmt)).decode("utf-8")
 
 
 def b64_to_img(enc: str):
-    """Convert base64-encoded string to image.
+    """Convert base64-encoded image to image.
 
     Args:
         enc (str): Base64-encoded image.
@@ -169,7 +279,160 @@ def b64_to_img(enc: str):
     Returns:
         Image: Image.
     """
-    return Image.open(BytesIO(b64decode(enc)))
+    return bytes_to_img(b64decode(enc))
+
+
+def img_to_bytes(image: Image.Image, fmt: str = "png"):
+    """Convert an image to encoded bytes.
+
+    Args:
+        image (Image): Image to encode.
+        fmt (str, optional): Name of codec in `IMAGE_CODECS`. Defaults to "png".
+
+    Raises:
+        KeyError: Codec cannot be found.
+
+    Returns:
+        bytes: Encoded image.
+    """
+    if fmt not in IMAGE_CODECS:
+        raise KeyError(f"output format not found: {fmt}")
+    buf = BytesIO()
+    IMAGE_CODECS[fmt](image, buf)
+    return buf.getvalue()
+
+
+def encode_imgs(images: List[Image.Image], fmt: str = "png", b64: bool = True):
+    """Encode images concurrently. Pillow releases the GIL while encoding, so
+    batches are encoded in parallel.
+
+    Args:
+        images (List[Image]): Images to encode.
+        fmt (str, optional): Name of codec in `IMAGE_CODECS`. Defaults to "png".
+        b64 (bool, optional): Whether to base64-encode. Defaults to True.
+
+    Returns:
+        List[Union[str, bytes]]: Encoded images.
+    """
+    global _encode_pool
+    encode = img_to_b64 if b64 else img_to_bytes
+    if len(images) < 2:
+        return [encode(image, fmt) for image in images]
+    if _encode_pool is None:
+        _encode_pool = ThreadPoolExecutor(thread_name_prefix="img_encode")
+    return list(_encode_pool.map(lambda image: encode(image, fmt), images))
+
+
+def bytes_to_img(data: bytes):
+    """Convert encoded bytes to image.
+
+    Args:
+        data (bytes): Encoded image in any format Pillow supports or raw (see `encode_raw`).
+
+    Returns:
+        Image: Image.
+    """
+    if data[: len(RAW_IMAGE_MAGIC)] == RAW_IMAGE_MAGIC:
+        pos = len(RAW_IMAGE_MAGIC)
+        width = int.from_bytes(data[pos : pos + 4], "big")
+        height = int.from_bytes(data[pos + 4 : pos + 8], "big")
+        return Image.frombytes("RGBA", (width, height), data[pos + 8 :])
+    return Image.open(BytesIO(data))
+
+
+def pack_parts(obj: dict):
+    """Pack dict into a binary body for the binary image transport.
+
+    Values that are bytes (or non-empty lists of bytes) are appended as-is after
+    a JSON header instead of being base64-encoded within the JSON. Layout:
+    4-byte big-endian header length, JSON header, then the raw parts in order.
+
+    Args:
+        obj (dict): Dict to pack.
+
+    Returns:
+        bytes: Packed body.
+    """
+    meta, sizes, parts = {}, {}, []
+    for k, v in obj.items():
+        if isinstance(v, bytes):
+            sizes[k] = len(v)
+            parts.append(v)
+        elif isinstance(v, list) and v and all(isinstance(x, bytes) for x in v):
+            sizes[k] = [len(x) for x in v]
+            parts.extend(v)
+        else:
+            meta[k] = v
+    head = json.dumps({"meta": meta, "parts": sizes}).encode("utf-8")
+    return b"".join([len(head).to_bytes(4, "big"), head, *parts])
+
+
+def pack_frame(obj: dict):
+    """Pack dict as a frame of a streamed response: 4-byte big-endian length
+    followed by the body packed by `pack_parts`.
+
+    Args:
+        obj (dict): Dict to pack.
+
+    Returns:
+        bytes: Packed frame.
+    """
+    body = pack_parts(obj)
+    return len(body).to_bytes(4, "big") + body
+
+
+def unpack_parts(data: bytes):
+    """Unpack binary body packed by `pack_parts`.
+
+    Args:
+        data (bytes): Packed body.
+
+    Returns:
+        dict: Unpacked dict, with raw parts as bytes.
+    """
+    size = int.from_bytes(data[:4], "big")
+    head = json.loads(data[4 : 4 + size])
+    obj = head["meta"]
+    pos = 4 + size
+    for k, sizes in head["parts"].items():
+        if isinstance(sizes, list):
+            obj[k] = []
+            for n in sizes:
+                obj[k].append(data[pos : pos + n])
+                pos += n
+        else:
+            obj[k] = data[pos : pos + sizes]
+            pos += sizes
+    return obj
+
+
+def get_etag(obj: dict):
+    """Get strong ETag of JSON-serializable object.
+
+    Args:
+        obj (dict): Response body.
+
+    Returns:
+        str: Quoted ETag that changes whenever `obj` does.
+    """
+    data = json.dumps(obj, sort_keys=True, default=str).encode("utf-8")
+    return f'"{hashlib.sha1(data).hexdigest()}"'
+
+
+def parse_etags(header: str):
+    """Parse ETags listed in an `If-None-Match` header.
+
+    Args:
+        header (str): Header value, i.e. `"a", W/"b"`.
+
+    Returns:
+        Set[str]: ETags, with weak ones stripped of `W/` (as weak comparison is used).
+    """
+    etags = set()
+    for tag in header.split(","):
+        tag = tag.strip()
+        etags.add(tag[2:] if tag.startswith("W/") else tag)
+    return etags
 
 
 def sddebz_highres_fix(
@@ -245,6 +508,9 @@ def sddebz_highres_fix(
 def parse_prompt(val):
     """Parse different representations of prompt/negative prompt.
 
+    Whitespace in string prompts is collapsed, so prompts differing only by it
+    share an entry in `cond_cache`.
+
     Args:
         val (Any): Prompt to parse.
 
@@ -256,9 +522,10 @@ def parse_prompt(val):
     """
     if val is None:
         return ""
-    # Below cases are meant for prompts read from the yaml config
+    # the text encoder collapses whitespace anyways
     if isinstance(val, str):
-        return val
+        return " ".join(val.split())
+    # Below cases are meant for prompts read from the yaml config
     if isinstance(val, list):
         return ", ".join(val)
     if isinstance(val, dict):
@@ -286,10 +553,7 @@ def get_sampler_index(sampler_name: str):
     Returns:
         int: Index of sampler.
     """
-    for index, sampler in enumerate(modules.sd_samplers.samplers):
-        if sampler_name == sampler.name or sampler_name in sampler.aliases:
-            return index
-    raise KeyError(f"sampler not found: {sampler_name}")
+    return sampler_index.get(sampler_name)
 
 
 def get_upscaler_index(upscaler_name: str):
@@ -304,10 +568,7 @@ def get_upscaler_index(upscaler_name: str):
     Returns:
         int: Index of sampler.
     """
-    for index, upscaler in enumerate(shared.sd_upscalers):
-        if upscaler.name == upscaler_name:
-            return index
-    raise KeyError(f"upscaler not found: {upscaler_name}")
+    return upscaler_index.get(upscaler_name)
 
 
 def prepare_mask(mask: Image.Image):
@@ -322,9 +583,216 @@ def prepare_mask(mask: Image.Image):
     return mask.getchannel("A")
 
 
-def bytewise_xor(msg: bytes, key: bytes):
-    """Used for decrypting/encrypting request/response bodies."""
-    return bytes(v ^ k for v, k in zip(msg, cycle(key)))
+def apply_mask(
+    images: List[Image.Image],
+    mask: Image.Image,
+    invert: bool = False,
+    background: Image.Image = None,
+    box: tuple = None,
+):
+    """Use mask as the alpha channel of inpainted images.
+
+    The whole batch is composited at once into a single preallocated RGBA
+    buffer, with the mask inverted only once.
+
+    Args:
+        images (List[Image]): Inpainted images.
+        mask (Image): The luminance mask (see `prepare_mask`).
+        invert (bool, optional): Whether to invert the mask. Defaults to False.
+        background (Image, optional): Image to paste `images` into, same size as mask. Defaults to None.
+        box (tuple, optional): Box (see `get_mask_box`) to paste `images` at. Defaults to None.
+
+    Returns:
+        List[Image]: RGBA images the size of the mask.
+    """
+    alpha = np.asarray(mask.convert("L"))
+    out = np.empty((len(images), *alpha.shape, 4), dtype=np.uint8)
+    out[..., 3] = 255 - alpha if invert else alpha
+    if background is not None:
+        out[..., :3] = np.asarray(background.convert("RGB"))
+
+    left, upper = (0, 0) if box is None else box[:2]
+    for dst, image in zip(out, images):
+        rgb = np.asarray(image.convert("RGB"))
+        dst[upper : upper + rgb.shape[0], left : left + rgb.shape[1], :3] = rgb
+    return [Image.fromarray(dst, "RGBA") for dst in out]
+
+
+def get_tile_starts(length: int, tile_size: int, overlap: int):
+    """Get start positions of tiles covering a length, with the last tile
+    aligned to the end.
+
+    Args:
+        length (int): Length to cover.
+        tile_size (int): Length of tiles.
+        overlap (int): Min overlap between tiles.
+
+    Returns:
+        List[int]: Start positions.
+    """
+    if length <= tile_size:
+        return [0]
+    step = max(tile_size - overlap, 1)
+    return list(range(0, length - tile_size, step)) + [length - tile_size]
+
+
+def get_blend_mask(size: tuple, left: int, top: int):
+    """Get mask to paste a tile with, fading in over its overlap with tiles
+    to its left & top.
+
+    Args:
+        size (tuple): Size of tile.
+        left (int): Width of overlap with the tile to the left.
+        top (int): Height of overlap with the tile above.
+
+    Returns:
+        Image: The luminance mask.
+    """
+    mask = Image.new("L", size, 255)
+    if left > 0:
+        # gradient is black to white from top to bottom, transposed to left to right
+        ramp = Image.linear_gradient("L").transpose(Image.TRANSPOSE)
+        mask.paste(ramp.resize((left, size[1])), (0, 0))
+    if top > 0:
+        ramp = Image.linear_gradient("L").resize((size[0], top))
+        edge = Image.new("L", size, 255)
+        edge.paste(ramp, (0, 0))
+        mask = ImageChops.multiply(mask, edge)
+    return mask
+
+
+def upscale_tiled(upscale: Callable, image: Image.Image, tile_size: int, overlap: int):
+    """Upscale image tile by tile, assembling the output as tiles finish.
+
+    Only one tile is upscaled at a time, so peak memory is the output plus a
+    tile instead of everything the upscaler allocates for the whole image.
+    Overlapping regions are linearly blended to hide seams.
+
+    Args:
+        upscale (Callable): Function that upscales an image.
+        image (Image): Image to upscale.
+        tile_size (int): Size of tiles in pixels.
+        overlap (int): Overlap between tiles in pixels.
+
+    Returns:
+        Image: Upscaled image.
+    """
+    width, height = image.size
+    overlap = min(max(overlap, 0), tile_size // 2)
+    xs = get_tile_starts(width, tile_size, overlap)
+    ys = get_tile_starts(height, tile_size, overlap)
+    log.info(f"upscaling in {len(xs) * len(ys)} tiles of {tile_size}px")
+
+    output, scale = None, None
+    for j, y in enumerate(ys):
+        for i, x in enumerate(xs):
+            box = (x, y, min(x + tile_size, width), min(y + tile_size, height))
+            tile = upscale(image.crop(box)).convert("RGB")
+            if output is None:
+                # upscalers may not scale by exactly the nominal scale, so measure it
+                scale = tile.width / (box[2] - box[0])
+                output = Image.new("RGB", (round(width * scale), round(height * scale)))
+
+            left = 0 if i == 0 else xs[i - 1] + tile_size - x
+            top = 0 if j == 0 else ys[j - 1] + tile_size - y
+            mask = get_blend_mask(tile.size, round(left * scale), round(top * scale))
+            output.paste(tile, (round(x * scale), round(y * scale)), mask)
+    return output
+
+
+def map_parallel(fn: Callable, items: list, limit: int = UPSCALE_MAX_PARALLEL):
+    """Map items on the upscale thread pool, keeping at most `limit` in flight
+    so concurrent requests share the pool.
+
+    Args:
+        fn (Callable): Function to map.
+        items (list): Items.
+        limit (int, optional): Max items processed at once. Defaults to UPSCALE_MAX_PARALLEL.
+
+    Returns:
+        list: Results in the same order as items.
+    """
+    global _upscale_pool
+    if _upscale_pool is None:
+        _upscale_pool = ThreadPoolExecutor(
+            UPSCALE_WORKERS, thread_name_prefix="upscale"
+        )
+    results, pending = [], deque()
+    for item in items:
+        if len(pending) >= limit:
+            results.append(pending.popleft().result())
+        pending.append(_upscale_pool.submit(fn, item))
+    results += [future.result() for future in pending]
+    return results
+
+
+def trim_img(image: Image.Image, box: tuple):
+    """Crop image, recording the position of the crop (see `get_offsets`).
+
+    Args:
+        image (Image): Image.
+        box (tuple): (left, upper, right, lower) box to crop to.
+
+    Returns:
+        Image: Cropped image.
+    """
+    image = image.crop(box)
+    image.info["offset"] = box[:2]
+    return image
+
+
+def get_offsets(images: List[Image.Image]):
+    """Get positions of trimmed images (see `trim_img`) in their source image.
+
+    Args:
+        images (List[Image]): Images.
+
+    Returns:
+        Union[List[List[int]], None]: [x, y] of each image, or None if none were trimmed.
+    """
+    if not any("offset" in image.info for image in images):
+        return None
+    return [list(image.info.get("offset", (0, 0))) for image in images]
+
+
+def get_mask_box(mask: Image.Image, padding: int, invert: bool = False):
+    """Get region of image covered by mask, plus padding for context.
+
+    Args:
+        mask (Image): The luminance mask (see `prepare_mask`).
+        padding (int): Pixels to pad the region by on each side.
+        invert (bool, optional): Whether the mask is inverted. Defaults to False.
+
+    Returns:
+        Union[Tuple[int, int, int, int], None]: (left, upper, right, lower) box, None if nothing is masked.
+    """
+    box = (ImageOps.invert(mask) if invert else mask).getbbox()
+    if box is None:
+        return None
+    left, upper, right, lower = box
+    return (
+        max(left - padding, 0),
+        max(upper - padding, 0),
+        min(right + padding, mask.width),
+        min(lower + padding, mask.height),
+    )
+
+
+def bytewise_xor(msg: bytes, key: bytes, offset: int = 0):
+    """Used for decrypting/encrypting request/response bodies.
+
+    `offset` is the position of `msg` within the whole body, used when the body
+    is processed in chunks. The XOR is done on the whole message at once as
+    big integers, which is far faster than going byte by byte.
+    """
+    size = len(msg)
+    if size == 0:
+        return b""
+    offset %= len(key)
+    key = key[offset:] + key[:offset]
+    stream = (key * (size // len(key) + 1))[:size]
+    res = int.from_bytes(msg, "little") ^ int.from_bytes(stream, "little")
+    return res.to_bytes(size, "little")
 
 
 def get_encrypt_key():
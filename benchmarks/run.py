@@ -0,0 +1,308 @@
+"""
+Offline benchmarks of the backend's request handling, with the stub `modules`
+package in `stubs/` standing in for the webUI. Generation itself is stubbed out,
+so this measures only the work the extension does around it: request parsing,
+config merging, the XOR middleware, image transport & masking/resizing.
+
+Needs the backend's own dependencies (fastapi, pydantic<2, pillow, numpy,
+pyyaml & gradio), but not the webUI or a GPU. From the repo root:
+
+    python benchmarks/run.py --sizes 512 1024 --batch 1 4 --filter img2img
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from base64 import b64encode
+from typing import Callable, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "benchmarks", "stubs"), ROOT]
+# the backend reads & writes its config, key & outputs in the working directory
+os.chdir(tempfile.mkdtemp(prefix="sd_paint_bench_"))
+
+import modules  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+import backend  # noqa: E402
+from backend.app import app_encryption_middleware  # noqa: E402
+from backend.config import ROUTE_PREFIX  # noqa: E402
+from backend.metrics import app_timing_middleware  # noqa: E402
+from backend.structs import Img2ImgRequest, Txt2ImgRequest  # noqa: E402
+from backend.utils import (  # noqa: E402
+    apply_mask,
+    b64_to_img,
+    bytewise_xor,
+    encode_imgs,
+    get_encrypt_key,
+    get_mask_box,
+    img_to_b64,
+    img_to_bytes,
+    load_config,
+    merge_default_config,
+    pack_parts,
+    prepare_mask,
+    upscale_tiled,
+)
+
+OUTPUT_FORMATS = ["png", "png_fast", "webp_lossless", "raw"]
+PROMPT = "a watercolor painting of a lighthouse on a cliff, (dramatic sky:1.2)"
+
+
+def make_app():
+    """Mount the backend the same way `scripts/main.py` does."""
+    app = FastAPI()
+    app.include_router(backend.router, prefix=ROUTE_PREFIX)
+    app.middleware("http")(app_encryption_middleware)
+    app.middleware("http")(app_timing_middleware)
+    return app
+
+
+async def call(app, path: str, body=b"", headers: dict = None, method="POST"):
+    """Send one request straight to the ASGI app, skipping the network.
+
+    Returns:
+        Tuple[int, dict, bytes]: Status, response headers and body.
+    """
+    headers = {**(headers or {}), "content-length": str(len(body))}
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "client": ("127.0.0.1", 0),
+        "server": ("127.0.0.1", 80),
+    }
+    done = asyncio.Event()
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+    res = {"status": None, "headers": {}, "body": []}
+
+    async def receive():
+        if pending:
+            return pending.pop()
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(msg):
+        if msg["type"] == "http.response.start":
+            res["status"] = msg["status"]
+            res["headers"] = {k.decode(): v.decode() for k, v in msg["headers"]}
+        elif msg["type"] == "http.response.body":
+            res["body"].append(msg.get("body", b""))
+            if not msg.get("more_body", False):
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return res["status"], res["headers"], b"".join(res["body"])
+
+
+def make_image(size: int, mode: str = "RGBA"):
+    """Source image the same size & mode the Krita plugin would send."""
+    return modules.processing.make_image(size, size).convert(mode)
+
+
+def make_mask(size: int):
+    """Mask in the alpha channel covering a feathered ellipse in the middle, so
+    `apply_mask` has partial alpha to deal with.
+    """
+    alpha = Image.new("L", (size, size))
+    ImageDraw.Draw(alpha).ellipse(
+        (size // 4, size // 4, size * 3 // 4, size * 3 // 4), fill=255
+    )
+    alpha = alpha.filter(ImageFilter.GaussianBlur(size / 64))
+    mask = Image.new("RGBA", (size, size))
+    mask.putalpha(alpha)
+    return mask
+
+
+def measure(fn: Callable, repeat: int, warmup: int):
+    """Time `fn`, discarding the warmup runs.
+
+    Returns:
+        Dict: Runs, throughput (ops/s) & latency percentiles (ms).
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+
+    def pct(p):
+        return times[min(len(times) - 1, int(p / 100 * len(times)))] * 1000
+
+    return {
+        "runs": repeat,
+        "ops": len(times) / sum(times),
+        "mean": statistics.mean(times) * 1000,
+        "p50": pct(50),
+        "p99": pct(99),
+    }
+
+
+def get_cases(sizes: List[int], batches: List[int]):
+    """Yield (name, size, batch, fn) for every case.
+
+    Cases that don't depend on the batch count only run with batch 1.
+    """
+    loop = asyncio.new_event_loop()
+    app = make_app()
+    key = get_encrypt_key()
+
+    def post(path, body, encrypted=False, expect=200, **headers):
+        if encrypted:
+            body = bytewise_xor(body, key)
+            headers["X-Encrypted-Body"] = "XOR"
+
+        def fn():
+            status, _, res = loop.run_until_complete(
+                call(app, ROUTE_PREFIX + path, body, headers)
+            )
+            assert status == expect, f"{path}: {status} {res[:200]!r}"
+
+        return fn
+
+    status, res_headers, _ = loop.run_until_complete(
+        call(app, ROUTE_PREFIX + "/config", method="GET")
+    )
+    assert status == 200, f"/config: {status}"
+    etag = res_headers["etag"]
+
+    def get_config(**headers):
+        def fn():
+            status, _, _ = loop.run_until_complete(
+                call(app, ROUTE_PREFIX + "/config", headers=headers, method="GET")
+            )
+            assert status in {200, 304}
+
+        return fn
+
+    yield "config", 0, 1, get_config()
+    yield "config (not modified)", 0, 1, get_config(**{"If-None-Match": etag})
+
+    for size in sizes:
+        image = make_image(size)
+        mask = make_mask(size)
+        png = img_to_bytes(image, "png")
+        b64 = b64encode(png).decode("utf-8")
+        raw_body = pack_parts({"src_img": png})
+
+        txt2img = {"prompt": PROMPT, "orig_width": size, "orig_height": size}
+        img2img = {**txt2img, "src_img": b64, "mask_img": img_to_b64(mask)}
+
+        def parse_txt2img(obj=txt2img):
+            req = Txt2ImgRequest.parse_obj(obj)
+            merge_default_config(req, load_config().txt2img)
+
+        def parse_img2img(obj=img2img):
+            req = Img2ImgRequest.parse_obj(obj)
+            merge_default_config(req, load_config().img2img)
+
+        yield "parse+merge txt2img", size, 1, parse_txt2img
+        yield "parse+merge img2img", size, 1, parse_img2img
+        yield "bytewise_xor", size, 1, lambda b=raw_body: bytewise_xor(b, key)
+        yield "img_to_b64", size, 1, lambda i=image: img_to_b64(i)
+        yield "b64_to_img", size, 1, lambda s=b64: b64_to_img(s).load()
+        yield "prepare_mask", size, 1, lambda m=mask: prepare_mask(m)
+        yield "get_mask_box", size, 1, lambda m=prepare_mask(mask): get_mask_box(m, 32)
+        # generation runs at 512 to 768px & is resized back to the source size
+        small = image.resize((size // 2, size // 2))
+        yield "resize", size, 1, lambda i=small, s=size: modules.images.resize_image(
+            0, i, s, s
+        )
+        yield "upscale_tiled", size, 1, lambda i=small: upscale_tiled(
+            lambda t: t.resize((t.width * 2, t.height * 2), Image.LANCZOS), i, 512, 32
+        )
+
+        for batch in batches:
+            images = [image.convert("RGB") for _ in range(batch)]
+            l_mask = prepare_mask(mask)
+            yield "apply_mask", size, batch, lambda i=images, m=l_mask: apply_mask(i, m)
+            for fmt in OUTPUT_FORMATS:
+                yield f"encode_imgs {fmt}", size, batch, lambda i=images, f=fmt: (
+                    encode_imgs(i, f, False)
+                )
+
+            req = {**txt2img, "batch_size": batch, "output_format": "png_fast"}
+            yield "POST /txt2img", size, batch, post(
+                "/txt2img", json.dumps(req).encode()
+            )
+            yield "POST /raw/txt2img", size, batch, post(
+                "/raw/txt2img", pack_parts(req)
+            )
+            yield "POST /raw/txt2img (XOR)", size, batch, post(
+                "/raw/txt2img", pack_parts(req), encrypted=True
+            )
+
+            req = {**img2img, "batch_size": batch, "output_format": "png_fast"}
+            yield "POST /img2img", size, batch, post(
+                "/img2img", json.dumps(req).encode()
+            )
+            req = {**req, "is_inpaint": True}
+            yield "POST /img2img inpaint", size, batch, post(
+                "/img2img", json.dumps(req).encode()
+            )
+            raw = {
+                **req,
+                "src_img": png,
+                "mask_img": img_to_bytes(mask, "png"),
+                "inpaint_full_res": True,
+            }
+            yield "POST /raw/img2img inpaint masked", size, batch, post(
+                "/raw/img2img", pack_parts(raw)
+            )
+            yield "POST /raw/img2img inpaint masked (XOR)", size, batch, post(
+                "/raw/img2img", pack_parts(raw), encrypted=True
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--filter", default="", help="regex of case names to run")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    pattern = re.compile(args.filter)
+    results = []
+    if not args.json:
+        print(
+            f"{'case':<40} {'size':>5} {'batch':>5} {'ops/s':>9} {'p50 ms':>9} {'p99 ms':>9}"
+        )
+    for name, size, batch, fn in get_cases(args.sizes, args.batch):
+        if not pattern.search(name):
+            continue
+        stats = measure(fn, args.repeat, args.warmup)
+        results.append({"case": name, "size": size, "batch": batch, **stats})
+        if not args.json:
+            print(
+                f"{name:<40} {size:>5} {batch:>5} {stats['ops']:>9.1f} "
+                f"{stats['p50']:>9.2f} {stats['p99']:>9.2f}"
+            )
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
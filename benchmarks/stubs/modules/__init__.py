@@ -0,0 +1,16 @@
+"""
+Lightweight stand-in for the webUI's `modules` package, just enough for
+`backend` to run on the CPU without a webUI install. Only for benchmarks.
+"""
+from . import (
+    call_queue,
+    devices,
+    images,
+    processing,
+    script_callbacks,
+    scripts,
+    sd_models,
+    sd_samplers,
+    sd_vae,
+    shared,
+)
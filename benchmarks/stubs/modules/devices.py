@@ -0,0 +1,3 @@
+from types import SimpleNamespace
+
+device = SimpleNamespace(type="cpu")
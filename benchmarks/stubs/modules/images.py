@@ -0,0 +1,6 @@
+from PIL import Image
+
+
+def resize_image(resize_mode, im, width, height, upscaler_name=None):
+    """Only stretch (`resize_mode` 0) is used by the backend."""
+    return im.resize((width, height), resample=Image.LANCZOS)
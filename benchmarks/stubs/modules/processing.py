@@ -0,0 +1,102 @@
+import json
+import random
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+from . import shared
+
+
+def get_fixed_seed(seed):
+    if seed is None or seed == "" or seed == -1:
+        return int(random.randrange(4294967294))
+    return seed
+
+
+@lru_cache(maxsize=8)
+def make_image(width: int, height: int):
+    """Noise over a gradient, which compresses about as badly as real outputs do."""
+    ramp = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = np.random.default_rng(0).normal(0, 24, (height, width, 3))
+    arr = np.clip(ramp + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(arr, "RGB")
+
+
+class StableDiffusionProcessing:
+    def __init__(
+        self,
+        sd_model=None,
+        prompt="",
+        seed=-1,
+        subseed=-1,
+        batch_size=1,
+        n_iter=1,
+        steps=50,
+        width=512,
+        height=512,
+        **kwargs,
+    ):
+        self.sd_model = sd_model
+        self.prompt = prompt
+        self.seed = seed
+        self.subseed = subseed
+        self.batch_size = batch_size
+        self.n_iter = n_iter
+        self.steps = steps
+        self.width = width
+        self.height = height
+        self.scripts = None
+        self.script_args = None
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def close(self):
+        pass
+
+
+class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
+    pass
+
+
+class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
+    def __init__(self, init_images=None, mask=None, **kwargs):
+        super().__init__(**kwargs)
+        self.init_images = init_images
+        self.image_mask = mask
+
+
+class Processed:
+    def __init__(self, p: StableDiffusionProcessing, images: list, seeds: list):
+        self.images = images
+        self.info = {
+            "prompt": p.prompt,
+            "all_prompts": [p.prompt] * len(images),
+            "seed": seeds[0],
+            "all_seeds": seeds,
+            "width": p.width,
+            "height": p.height,
+            "steps": p.steps,
+            "batch_size": p.batch_size,
+        }
+
+    def js(self):
+        return json.dumps(self.info)
+
+
+def process_images(p: StableDiffusionProcessing):
+    """Stand-in for the diffusion loop. Outputs are copies of one image per size,
+    so time spent here is negligible next to the backend's own work.
+    """
+    count = p.n_iter * p.batch_size
+    if isinstance(p.seed, list):
+        seeds = p.seed[:count]
+    else:
+        seed = int(get_fixed_seed(p.seed))
+        seeds = [seed + i for i in range(count)]
+
+    shared.state.job_count = p.n_iter
+    shared.state.sampling_steps = p.steps
+    images = [make_image(p.width, p.height).copy() for _ in range(count)]
+    shared.state.job_no = p.n_iter
+    return Processed(p, images, seeds)
@@ -0,0 +1,14 @@
+def on_app_started(callback):
+    pass
+
+
+def on_ui_tabs(callback):
+    pass
+
+
+def on_ui_settings(callback):
+    pass
+
+
+def on_script_unloaded(callback):
+    pass
@@ -0,0 +1,23 @@
+import os
+
+
+class Script:
+    def title(self):
+        raise NotImplementedError
+
+    def ui(self, is_img2img):
+        return []
+
+
+class ScriptRunner:
+    def __init__(self):
+        self.titles = []
+        self.selectable_scripts = []
+
+
+scripts_txt2img = ScriptRunner()
+scripts_img2img = ScriptRunner()
+
+
+def basedir():
+    return os.getcwd()
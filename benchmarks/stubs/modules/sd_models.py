@@ -0,0 +1,23 @@
+from . import shared
+
+
+class CheckpointInfo:
+    def __init__(self, title: str):
+        self.title = title
+        self.filename = f"{title}.safetensors"
+        self.model_name = title
+
+
+checkpoints_list = {title: CheckpointInfo(title) for title in ["model.ckpt"]}
+
+
+def checkpoint_tiles():
+    return list(checkpoints_list)
+
+
+def get_closet_checkpoint_match(search_string):
+    return checkpoints_list.get(search_string)
+
+
+def reload_model_weights(sd_model=None, info=None):
+    shared.sd_model.sd_checkpoint_info = info or next(iter(checkpoints_list.values()))
@@ -0,0 +1,13 @@
+from collections import namedtuple
+
+SamplerData = namedtuple("SamplerData", ["name", "constructor", "aliases", "options"])
+
+samplers = [
+    SamplerData(name, None, [alias], {})
+    for name, alias in [
+        ("Euler a", "k_euler_a"),
+        ("Euler", "k_euler"),
+        ("LMS", "k_lms"),
+    ]
+]
+samplers_for_img2img = samplers
@@ -0,0 +1,6 @@
+vae_dict = {}
+loaded_vae_file = None
+
+
+def reload_vae_weights(sd_model=None, vae_file=None):
+    pass
@@ -0,0 +1,110 @@
+import time
+from types import SimpleNamespace
+
+from PIL import Image
+
+
+class Options(SimpleNamespace):
+    def add_option(self, key, info):
+        setattr(self, key, info.default)
+
+
+class OptionInfo:
+    def __init__(self, default=None, label="", component=None, section=None):
+        self.default = default
+
+
+class State:
+    def __init__(self):
+        self.interrupted = False
+        self.skipped = False
+        self.job = ""
+        self.job_count = 0
+        self.job_no = 0
+        self.sampling_step = 0
+        self.sampling_steps = 0
+        self.time_start = None
+        self.current_image = None
+
+    def begin(self):
+        self.interrupted = False
+        self.job_count = -1
+        self.job_no = 0
+        self.sampling_step = 0
+        self.time_start = time.time()
+
+    def end(self):
+        self.job_count = 0
+
+    def interrupt(self):
+        self.interrupted = True
+
+    def set_current_image(self):
+        pass
+
+    def dict(self):
+        return {
+            "skipped": self.skipped,
+            "interrupted": self.interrupted,
+            "job": self.job,
+            "job_count": self.job_count,
+            "job_no": self.job_no,
+            "sampling_step": self.sampling_step,
+            "sampling_steps": self.sampling_steps,
+        }
+
+
+class PILScaler:
+    def __init__(self, resample):
+        self.resample = resample
+
+    def upscale(self, img: Image.Image, scale: float, data_path: str):
+        size = (int(img.width * scale), int(img.height * scale))
+        return img.resize(size, resample=self.resample)
+
+
+class UpscalerData:
+    def __init__(self, name: str, scaler=None, scale: float = 4):
+        self.name = name
+        self.scaler = scaler
+        self.scale = scale
+        self.data_path = None
+
+
+class FaceRestoration:
+    def __init__(self, name: str):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+class TotalTQDM:
+    def clear(self):
+        pass
+
+
+opts = Options(
+    outdir_samples="",
+    outdir_txt2img_samples="outputs/txt2img-images",
+    outdir_img2img_samples="outputs/img2img-images",
+    outdir_grids="",
+    outdir_txt2img_grids="outputs/txt2img-grids",
+    outdir_img2img_grids="outputs/img2img-grids",
+    return_grid=False,
+    live_previews_enable=False,
+    sd_model_checkpoint="model.ckpt",
+    sd_vae="Automatic",
+    sd_checkpoint_cache=0,
+    hide_auto_sd_paint_ext_tab=False,
+)
+cmd_opts = SimpleNamespace(api=True, listen=False)
+state = State()
+total_tqdm = TotalTQDM()
+sd_model = SimpleNamespace(sd_checkpoint_info=None)
+sd_upscalers = [
+    UpscalerData("None"),
+    UpscalerData("Lanczos", PILScaler(Image.LANCZOS)),
+    UpscalerData("Nearest", PILScaler(Image.NEAREST)),
+]
+face_restorers = [FaceRestoration("CodeFormer"), FaceRestoration("GFPGAN")]
@@ -1,19 +1,28 @@
 import json
 import socket
+from http.client import IncompleteRead
 from typing import Any, Dict, List
-from urllib.error import URLError
-from urllib.parse import urljoin, urlparse
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urljoin, urlparse
 from urllib.request import Request, urlopen
 
-from krita import QObject, QThread, pyqtSignal
+from krita import QImage, QObject, QThread, QTimer, pyqtSignal
 
 from .config import Config
 from .defaults import (
     ERR_BAD_URL,
     ERR_NO_CONNECTION,
+    JOB_MAX_POLL_ERRORS,
+    JOB_POLL_INTERVAL,
     LONG_TIMEOUT,
     OFFICIAL_ROUTE_PREFIX,
+    PREVIEW_FORMAT,
+    PREVIEW_QUALITY,
+    RAW_CONTENT_TYPE,
+    RAW_ROUTE,
     ROUTE_PREFIX,
+    STREAM_CONTENT_TYPE,
+    STREAM_ROUTE,
     CONTROLNET_ROUTE_PREFIX,
     SHORT_TIMEOUT,
     STATE_DONE,
@@ -27,7 +36,10 @@ from .utils import (
     get_ext_args, 
     get_ext_key, 
     img_to_b64, 
-    calculate_resized_image_dimensions
+    img_to_bytes,
+    calculate_resized_image_dimensions,
+    pack_parts,
+    unpack_parts,
 )
 
 # NOTE: backend queues up responses, so no explicit need to block multiple requests
@@ -47,12 +59,17 @@ def get_url(cfg: Config, route: str = ..., prefix: str = ROUTE_PREFIX):
     return url
 
 
+class BackendError(Exception):
+    """Error reported by the backend in a streamed response."""
+
+
 # krita doesn't reexport QtNetwork
 class AsyncRequest(QObject):
     timeout = None
     finished = pyqtSignal()
     result = pyqtSignal(object)
     error = pyqtSignal(Exception)
+    etag = pyqtSignal(str)
 
     def __init__(
         self,
@@ -62,24 +79,38 @@ class AsyncRequest(QObject):
         method: str = ...,
         headers: dict = ...,
         key: str = None,
+        raw: bool = False,
+        until_done: bool = True,
     ):
         """Create an AsyncRequest object.
 
         By default, AsyncRequest has no timeout, will infer whether it is "POST"
-        or "GET" based on the presence of `data` and uses JSON to transmit. It
-        also assumes the response is JSON.
+        or "GET" based on the presence of `data` and uses JSON to transmit. The
+        response is parsed as JSON unless the server packed it with `pack_parts`.
+        A 304 (Not Modified) response results in None.
 
         Args:
             url (str): URL to request from.
             data (Any, optional): Payload to send. Defaults to None.
             timeout (int, optional): Timeout for request. Defaults to `...`.
             method (str, optional): Which HTTP method to use. Defaults to `...`.
+            headers (dict, optional): Extra request headers. Defaults to `...`.
             key (Union[str, None], Optional): Key to use for encryption/decryption. Defaults to None.
+            raw (bool, optional): Send `data` using `pack_parts` (binary image transport) instead of JSON. Defaults to False.
+            until_done (bool, optional): A streamed response failed unless its last frame has `done` set. Defaults to True.
         """
         super(AsyncRequest, self).__init__()
         self.url = url
-        self.data = None if data is None else json.dumps(data).encode("utf-8")
+        # set to stop emitting results of a streamed response
+        self.cancelled = False
+        self.until_done = until_done
         self.headers = {} if headers is ... else headers
+        if data is None:
+            self.data = None
+        elif raw:
+            self.data = pack_parts(data)
+        else:
+            self.data = json.dumps(data).encode("utf-8")
 
         self.key = None
         if isinstance(key, str) and key.strip() != "":
@@ -98,27 +129,78 @@ class AsyncRequest(QObject):
                 # print(f"Encrypting with ${self.key}:\n{self.data}")
                 self.data = bytewise_xor(self.data, self.key)
                 # print(f"Encrypt Result:\n{self.data}")
-            self.headers["Content-Type"] = "application/json"
+            self.headers["Content-Type"] = RAW_CONTENT_TYPE if raw else "application/json"
             self.headers["Content-Length"] = str(len(self.data))
 
     def run(self):
         req = Request(self.url, headers=self.headers, method=self.method)
         try:
             with urlopen(req, self.data, self.timeout) as res:
-                data = res.read()
+                if res.getheader("ETag", None) is not None:
+                    self.etag.emit(res.getheader("ETag"))
                 enc_type = res.getheader("X-Encrypted-Body", None)
                 assert enc_type in {"XOR", None}, "Unknown server encryption!"
+                if res.getheader("Content-Type", "").startswith(STREAM_CONTENT_TYPE):
+                    self.read_stream(res, enc_type == "XOR")
+                    return
+                data = res.read()
                 if enc_type == "XOR":
                     assert self.key, f"Key needed to decrypt server response!"
                     # print(f"Decrypting with ${self.key}:\n{data}")
                     data = bytewise_xor(data, self.key)
                     # print(f"Decrypt Result:\n{data}")
-                self.result.emit(json.loads(data))
+                if res.getheader("Content-Type", "").startswith(RAW_CONTENT_TYPE):
+                    self.result.emit(unpack_parts(data))
+                else:
+                    self.result.emit(json.loads(data))
+        except HTTPError as e:
+            # urllib treats 304 as an error, but it means the cached copy is still valid
+            if e.code == 304:
+                self.result.emit(None)
+            else:
+                self.error.emit(e)
         except Exception as e:
             self.error.emit(e)
         finally:
             self.finished.emit()
 
+    def read_stream(self, res, is_encrypted: bool):
+        """Emit result for each frame of a streamed response as it arrives.
+
+        See `backend.utils.pack_frame()`. Raises `BackendError` if a frame has
+        an `error`, or if `until_done` and the stream ends before a `done` frame.
+        """
+        assert not is_encrypted or self.key, f"Key needed to decrypt server response!"
+        pos = 0
+
+        def read(n):
+            nonlocal pos
+            data = res.read(n)
+            if is_encrypted:
+                data = bytewise_xor(data, self.key, pos)
+            pos += len(data)
+            return data
+
+        done = False
+        try:
+            while not self.cancelled and not done:
+                head = read(4)
+                if len(head) < 4:
+                    break
+                size = int.from_bytes(head, "big")
+                data = read(size)
+                if len(data) < size:
+                    break
+                frame = unpack_parts(data)
+                if frame.get("error") is not None:
+                    raise BackendError(frame["error"])
+                done = frame.get("done", False)
+                self.result.emit(frame)
+        except IncompleteRead:
+            pass
+        if self.until_done and not done and not self.cancelled:
+            raise BackendError("response ended before it was done, check terminal")
+
     @classmethod
     def request(cls, *args, **kwargs):
         req = cls(*args, **kwargs)
@@ -151,9 +233,17 @@ class Client(QObject):
         self.long_reqs = set()
         # NOTE: this is a hacky workaround for detecting if backend is reachable
         self.is_connected = False
+        # ETag of the last config applied, to skip applying it again if unchanged
+        self.config_etag = None
+        # streamed request pushing progress, if subscribed
+        self.progress_req = None
 
     def handle_api_error(self, exc: Exception):
         """Handle exceptions that can occur while interacting with the backend."""
+        if isinstance(exc, BackendError):
+            # backend is reachable, the request itself failed
+            self.status.emit(f"Backend Error: {exc}")
+            return
         self.is_connected = False
         try:
             # wtf python? socket raises an error that isnt an Exception??
@@ -177,7 +267,17 @@ class Client(QObject):
             assert False, e
 
     def post(
-        self, route, body, cb, base_url=..., is_long=True, ignore_no_connection=False
+        self,
+        route,
+        body,
+        cb,
+        base_url=...,
+        is_long=True,
+        ignore_no_connection=False,
+        raw=False,
+        err_cb=None,
+        headers=...,
+        etag_cb=None,
     ):
         if not ignore_no_connection and not self.is_connected:
             self.status.emit(ERR_NO_CONNECTION)
@@ -190,7 +290,9 @@ class Client(QObject):
             url,
             body,
             LONG_TIMEOUT if is_long else SHORT_TIMEOUT,
+            headers=headers,
             key=self.cfg("encryption_key"),
+            raw=raw,
         )
 
         if is_long:
@@ -204,12 +306,26 @@ class Client(QObject):
             if is_long and len(self.long_reqs) == 0:
                 self.status.emit(STATE_DONE)
 
+        if etag_cb is not None:
+            req.etag.connect(etag_cb)
         req.result.connect(cb)
         req.error.connect(lambda e: self.handle_api_error(e))
+        if err_cb is not None:
+            req.error.connect(err_cb)
         req.finished.connect(handler)
         start()
 
-    def get(self, route, cb, base_url=..., is_long=False, ignore_no_connection=False):
+    def get(
+        self,
+        route,
+        cb,
+        base_url=...,
+        is_long=False,
+        ignore_no_connection=False,
+        err_cb=None,
+        headers=...,
+        etag_cb=None,
+    ):
         self.post(
             route,
             None,
@@ -217,8 +333,103 @@ class Client(QObject):
             base_url=base_url,
             is_long=is_long,
             ignore_no_connection=ignore_no_connection,
+            err_cb=err_cb,
+            headers=headers,
+            etag_cb=etag_cb,
         )
 
+    def post_job(self, route, body, cb):
+        """Submit job to the backend's job API, poll it until it is done, then
+        call `cb` with the result.
+
+        Unlike a long request, no connection is held open during generation, and
+        polling carries on through connection errors.
+        """
+        if not self.is_connected:
+            self.status.emit(ERR_NO_CONNECTION)
+            return
+
+        # counts as a long request until the result is retrieved
+        pending = object()
+        self.long_reqs.add(pending)
+        job_id = None
+        errors = 0
+
+        def done():
+            self.long_reqs.discard(pending)
+            if len(self.long_reqs) == 0:
+                self.status.emit(STATE_DONE)
+
+        def finish(result):
+            try:
+                cb(result)
+            finally:
+                done()
+
+        def poll():
+            self.get(
+                f"jobs/{job_id}", on_status, ignore_no_connection=True, err_cb=on_error
+            )
+
+        def on_error(e):
+            nonlocal errors
+            errors += 1
+            if errors > JOB_MAX_POLL_ERRORS:
+                done()
+            else:
+                QTimer.singleShot(JOB_POLL_INTERVAL, poll)
+
+        def on_status(obj):
+            nonlocal errors
+            errors = 0
+            status = obj["status"]
+            if status in {"queued", "running"}:
+                QTimer.singleShot(JOB_POLL_INTERVAL, poll)
+            elif status == "failed":
+                self.status.emit(f"{STATE_URLERROR}: job failed, {obj['error']}")
+                done()
+            else:
+                self.get(
+                    f"jobs/{job_id}/result",
+                    finish,
+                    ignore_no_connection=True,
+                    err_cb=on_error,
+                )
+
+        def on_submit(obj):
+            nonlocal job_id
+            job_id = obj["id"]
+            QTimer.singleShot(JOB_POLL_INTERVAL, poll)
+
+        self.post(
+            f"jobs/{route}", body, on_submit, is_long=False, err_cb=lambda e: done()
+        )
+
+    def post_images(self, route, body, cb, stream=False):
+        """Post to a route that takes images, using the binary image transport if enabled.
+
+        Images in `body` should be QImages; they are encoded depending on the transport.
+        If `stream` is True, outputs are streamed batch by batch (always using the
+        binary image transport) and `cb` is called for each batch. If the job API
+        is enabled, it takes precedence over both.
+        """
+        if self.cfg("use_job_api", bool):
+            body = {
+                k: img_to_b64(v) if isinstance(v, QImage) else v
+                for k, v in body.items()
+            }
+            self.post_job(route, body, cb)
+            return
+
+        raw = stream or self.cfg("binary_transport", bool)
+        enc = img_to_bytes if raw else img_to_b64
+        body = {k: enc(v) if isinstance(v, QImage) else v for k, v in body.items()}
+        if stream:
+            route = STREAM_ROUTE + route
+        elif raw:
+            route = RAW_ROUTE + route
+        self.post(route, body, cb, raw=raw)
+
     def common_params(self, has_selection):
         """Parameters nearly all the post routes share."""
         tiling = self.cfg("sd_tiling", bool) and not (
@@ -244,6 +455,7 @@ class Client(QObject):
             do_exact_steps=self.cfg("do_exact_steps", bool),
             include_grid=self.cfg("include_grid", bool),
             save_samples=self.cfg("save_temp_images", bool),
+            output_format=self.cfg("output_format", str),
         )
         return params
     
@@ -320,7 +532,19 @@ class Client(QObject):
         return params
 
     def get_config(self):
+        etag = None
+
+        def etag_cb(val):
+            nonlocal etag
+            etag = val
+
         def cb(obj):
+            if obj is None:
+                # 304: backend config unchanged since it was last applied
+                if not self.is_connected:
+                    self.is_connected = True
+                    self.status.emit(STATE_READY)
+                return
             try:
                 assert "sample_path" in obj
                 assert len(obj["upscalers"]) > 0
@@ -368,11 +592,16 @@ class Client(QObject):
                             key = get_ext_key(ext_type, ext_name, i)
                             self.ext_cfg.set(key, opt["val"])
 
+            # only remember ETag once config was verified & applied
+            self.config_etag = etag
             self.is_connected = True
             self.status.emit(STATE_READY)
             self.config_updated.emit()
 
-        self.get("config", cb, ignore_no_connection=True)
+        headers = {} if self.config_etag is None else {"If-None-Match": self.config_etag}
+        self.get(
+            "config", cb, ignore_no_connection=True, headers=headers, etag_cb=etag_cb
+        )
 
     def get_controlnet_config(self):
         '''Get models and modules for ControlNet'''
@@ -434,7 +663,7 @@ class Client(QObject):
                 script_args=ext_args,
             )
 
-        self.post("txt2img", params, cb)
+        self.post_images("txt2img", params, cb, self.cfg("stream_results", bool))
 
     def post_official_api_txt2img(self, cb, width, height, has_selection, 
                                     controlnet_src_imgs: dict = {}):
@@ -477,7 +706,7 @@ class Client(QObject):
             self.post("txt2img", params, cb, base_url=url)
 
     def post_img2img(self, cb, src_img, mask_img, has_selection):
-        params = dict(is_inpaint=False, src_img=img_to_b64(src_img))   
+        params = dict(is_inpaint=False, src_img=src_img)
         if not self.cfg("just_use_yaml", bool):
             seed = (
                 int(self.cfg("img2img_seed", str))  # Qt casts int as 32-bit int
@@ -500,7 +729,7 @@ class Client(QObject):
                 seed=seed,
             )
 
-        self.post("img2img", params, cb)
+        self.post_images("img2img", params, cb, self.cfg("stream_results", bool))
 
     def post_official_api_img2img(self, cb, src_img, width, height, has_selection, 
                                 controlnet_src_imgs: dict = {}):
@@ -541,9 +770,7 @@ class Client(QObject):
 
     def post_inpaint(self, cb, src_img, mask_img, has_selection):
         assert mask_img, "Inpaint layer is needed for inpainting!"
-        params = dict(
-            is_inpaint=True, src_img=img_to_b64(src_img), mask_img=img_to_b64(mask_img)
-        )
+        params = dict(is_inpaint=True, src_img=src_img, mask_img=mask_img)
 
         if not self.cfg("just_use_yaml", bool):
             seed = (
@@ -571,13 +798,14 @@ class Client(QObject):
                 invert_mask=self.cfg("inpaint_invert_mask", bool),
                 # mask_blur=self.cfg("inpaint_mask_blur", int),
                 inpainting_fill=fill,
-                # inpaint_full_res=self.cfg("inpaint_full_res", bool),
-                # inpaint_full_res_padding=self.cfg("inpaint_full_res_padding", int),
+                inpaint_full_res=self.cfg("inpaint_full_res", bool),
+                inpaint_full_res_padding=self.cfg("inpaint_full_res_padding", int),
                 inpaint_mask_weight=self.cfg("inpaint_mask_weight", float),
                 include_grid=False,  # it is never useful for inpaint mode
+                trim_to_mask=True,  # only transfer & insert the inpainted region
             )
 
-        self.post("img2img", params, cb)
+        self.post_images("img2img", params, cb, self.cfg("stream_results", bool))
 
     def post_official_api_inpaint(self, cb, src_img, mask_img, width, height, has_selection, 
                                 controlnet_src_imgs: dict = {}):
@@ -633,14 +861,15 @@ class Client(QObject):
     def post_upscale(self, cb, src_img):
         params = (
             {
-                "src_img": img_to_b64(src_img),
+                "src_img": src_img,
                 "upscaler_name": self.cfg("upscale_upscaler_name", str),
                 "downscale_first": self.cfg("upscale_downscale_first", bool),
+                "output_format": self.cfg("output_format", str),
             }
             if not self.cfg("just_use_yaml", bool)
-            else {"src_img": img_to_b64(src_img)}
+            else {"src_img": src_img}
         )
-        self.post("upscale", params, cb)
+        self.post_images("upscale", params, cb)
 
     def post_official_api_upscale_postprocess(self, cb, src_imgs: list, width, height):
         """Uses official API. Intended for finalizing img2img pipeline."""
@@ -702,7 +931,48 @@ class Client(QObject):
         url = get_url(self.cfg, prefix=OFFICIAL_ROUTE_PREFIX)
         self.post("interrupt", {}, cb, base_url=url)
 
-    def get_progress(self, cb):
-        # get official API url
-        url = get_url(self.cfg, prefix=OFFICIAL_ROUTE_PREFIX)
-        self.get("progress", cb, base_url=url)
\ No newline at end of file
+    def subscribe_progress(self, cb, preview_size=0):
+        """Call `cb` with progress whenever the backend pushes it, until
+        `unsubscribe_progress` is called.
+
+        The backend ends the stream once idle, so it is renewed while there are
+        long requests left. The live preview is downscaled to fit `preview_size`
+        (0 for full size) and only sent when it changed.
+        """
+        if self.progress_req is not None:
+            return
+        query = urlencode(
+            dict(size=preview_size, format=PREVIEW_FORMAT, quality=PREVIEW_QUALITY)
+        )
+        url = get_url(self.cfg, f"progress?{query}")
+        if not url:
+            self.status.emit(ERR_BAD_URL)
+            return
+        # frames only arrive on change, so no timeout; stream ends once idle
+        req, start = AsyncRequest.request(
+            url, None, LONG_TIMEOUT, key=self.cfg("encryption_key"), until_done=False
+        )
+        self.progress_req = req
+        failed = False
+
+        def err_handler(e):
+            nonlocal failed
+            failed = True
+            self.handle_api_error(e)
+
+        def handler():
+            if self.progress_req is not req:
+                return
+            self.progress_req = None
+            if not failed and len(self.long_reqs) > 0:
+                self.subscribe_progress(cb, preview_size)
+
+        req.result.connect(cb)
+        req.error.connect(err_handler)
+        req.finished.connect(handler)
+        start()
+
+    def unsubscribe_progress(self):
+        if self.progress_req is not None:
+            self.progress_req.cancelled = True
+            self.progress_req = None
\ No newline at end of file
@@ -17,7 +17,12 @@ STATE_INTERRUPT = "Interrupted!"
 SHORT_TIMEOUT = 10
 LONG_TIMEOUT = None  # requests that might take "forever", i.e., image generation with high batch count
 REFRESH_INTERVAL = 3000  # 3 seconds between auto-config refresh
-ETA_REFRESH_INTERVAL = 250  # milliseconds between eta refresh
+PREVIEW_FORMAT = "jpeg"  # format of live preview thumbnails, jpeg or webp
+PREVIEW_QUALITY = 80  # quality of live preview thumbnails from 1 to 100
+SAVE_QUALITY = 80  # png quality of saved temp images; higher is faster with less compression
+SAVE_QUEUE_SIZE = 8  # max temp images pending to be saved before the UI waits
+JOB_POLL_INTERVAL = 1000  # milliseconds between polling status of a job
+JOB_MAX_POLL_ERRORS = 30  # consecutive failed polls before giving up on a job
 CFG_FOLDER = "krita"  # which folder in ~/.config to store config
 CFG_NAME = "krita_diff_plugin"  # name of config file
 EXT_CFG_NAME = "krita_diff_plugin_scripts"  # name of config file
@@ -27,6 +32,11 @@ ROUTE_PREFIX = "/sdapi/interpause/"
 OFFICIAL_ROUTE_PREFIX = "/sdapi/v1/"
 CONTROLNET_ROUTE_PREFIX = "/controlnet/"
 CONTROLNET_ROUTE_PREFIX = "/controlnet/"
+RAW_ROUTE = "raw/"  # routes under ROUTE_PREFIX that use the binary image transport
+RAW_CONTENT_TYPE = "application/x-sd-paint-parts"
+STREAM_ROUTE = "stream/"  # routes under ROUTE_PREFIX that stream outputs batch by batch
+STREAM_CONTENT_TYPE = "application/x-sd-paint-stream"
+RAW_IMAGE_MAGIC = b"RGBA"  # prefix of images returned in the "raw" output_format
 
 # error messages
 ERR_MISSING_CONFIG = "Report this bug, developer missed out a config key somewhere."
@@ -189,6 +199,13 @@ class Defaults:
     hide_layers: bool = True
     no_groups: bool = False
     disable_sddebz_highres: bool = True
+    binary_transport: bool = True
+    stream_results: bool = True
+    use_job_api: bool = False
+    output_format_list: List[str] = field(
+        default_factory=lambda: ["png", "png_fast", "webp_lossless", "raw"]
+    )
+    output_format: str = "png_fast"
 
     sd_model_list: List[str] = field(default_factory=lambda: [ERROR_MSG])
     sd_model: str = "model.ckpt"
@@ -247,8 +264,8 @@ class Defaults:
         default_factory=lambda: ["blur", "preserve", "latent noise", "latent empty"]
     )
     inpaint_fill: str = "preserve"
-    # inpaint_full_res: bool = False
-    # inpaint_full_res_padding: int = 32
+    inpaint_full_res: bool = False
+    inpaint_full_res_padding: int = 32
     inpaint_color_correct: bool = False
     inpaint_script: str = "None"
     inpaint_script_list: List[str] = field(default_factory=lambda: [ERROR_MSG])
@@ -5,7 +5,13 @@ from krita import QHBoxLayout, QLineEdit, QPushButton, QVBoxLayout, QWidget
 from ..defaults import DEFAULTS
 from ..script import script
 from ..utils import reset_docker_layout
-from ..widgets import QCheckBox, QLabel, QLineEditLayout, StatusBar
+from ..widgets import (
+    QCheckBox,
+    QComboBoxLayout,
+    QLabel,
+    QLineEditLayout,
+    StatusBar,
+)
 
 
 class ConfigPage(QWidget):
@@ -51,6 +57,18 @@ class ConfigPage(QWidget):
         )
         self.hide_layers = QCheckBox(script.cfg, "hide_layers", "Auto hide layers")
         self.no_groups = QCheckBox(script.cfg, "no_groups", "Don't create group layers")
+        self.binary_transport = QCheckBox(
+            script.cfg, "binary_transport", "Send images as binary (faster)"
+        )
+        self.stream_results = QCheckBox(
+            script.cfg, "stream_results", "Insert batches as they finish"
+        )
+        self.use_job_api = QCheckBox(
+            script.cfg, "use_job_api", "Poll for results (unstable connections)"
+        )
+        self.output_format = QComboBoxLayout(
+            script.cfg, "output_format_list", "output_format", label="Output format:"
+        )
 
         # webUI/backend settings
         self.filter_nsfw = QCheckBox(script.cfg, "filter_nsfw", "Filter NSFW")
@@ -90,6 +108,10 @@ class ConfigPage(QWidget):
         layout_inner.addWidget(self.only_full_img_tiling)
         layout_inner.addWidget(self.include_grid)
         layout_inner.addWidget(self.save_temp_images)
+        layout_inner.addWidget(self.binary_transport)
+        layout_inner.addWidget(self.stream_results)
+        layout_inner.addWidget(self.use_job_api)
+        layout_inner.addLayout(self.output_format)
         # layout_inner.addWidget(self.just_use_yaml)
 
         layout_inner.addWidget(QLabel("<em>Backend/webUI settings:</em>"))
@@ -136,6 +158,10 @@ class ConfigPage(QWidget):
         self.alt_docker.cfg_init()
         self.hide_layers.cfg_init()
         self.no_groups.cfg_init()
+        self.binary_transport.cfg_init()
+        self.stream_results.cfg_init()
+        self.use_job_api.cfg_init()
+        self.output_format.cfg_init()
 
         info_text = """
             <em>Tip:</em> Only a selected few backend/webUI settings are exposed above.<br/>
@@ -172,6 +198,10 @@ class ConfigPage(QWidget):
         self.alt_docker.cfg_connect()
         self.hide_layers.cfg_connect()
         self.no_groups.cfg_connect()
+        self.binary_transport.cfg_connect()
+        self.stream_results.cfg_connect()
+        self.use_job_api.cfg_connect()
+        self.output_format.cfg_connect()
 
         def restore_defaults():
             script.restore_defaults()
@@ -29,29 +29,29 @@ class InpaintPage(SDImgPageBase):
             script.cfg, "inpaint_fill_list", "inpaint_fill", label="Inpaint fill:"
         )
 
-        # self.full_res = QCheckBox(script.cfg, "inpaint_full_res", "Inpaint full res")
-        # self.full_res_padding_layout = QSpinBoxLayout(
-        #     script.cfg,
-        #     "inpaint_full_res_padding",
-        #     "Padding (px):",
-        #     min=0,
-        #     max=9999,
-        #     step=1,
-        # )
+        self.full_res = QCheckBox(script.cfg, "inpaint_full_res", "Only masked")
+        self.full_res_padding_layout = QSpinBoxLayout(
+            script.cfg,
+            "inpaint_full_res_padding",
+            "Padding (px):",
+            min=0,
+            max=9999,
+            step=1,
+        )
 
         inline2 = QHBoxLayout()
-        # inline2.addWidget(self.full_res)
-        # inline2.addLayout(self.full_res_padding_layout)
+        inline2.addWidget(self.full_res)
+        inline2.addLayout(self.full_res_padding_layout)
 
         self.tips = TipsLayout(
             [
                 "Ensure the inpaint layer is selected.",
-                "Select what the model will see when inpainting. <em>Inpaint full res</em> is unnecessary.",
+                "Select what the model will see when inpainting. <em>Only masked</em> inpaints just the area around the mask, which is faster for small masks.",
             ]
         )
         self.tips2 = TipsLayout(
             [
-                '<a href="https://github.com/Interpause/auto-sd-paint-ext/wiki/Usage-Guide#inpainting" target="_blank">Inpaint Full Res & Mask Blur is obsolete; Click for new method.</a>'
+                '<a href="https://github.com/Interpause/auto-sd-paint-ext/wiki/Usage-Guide#inpainting" target="_blank">Mask Blur is obsolete; Click for new method.</a>'
             ],
             prefix="",
         )
@@ -70,9 +70,9 @@ class InpaintPage(SDImgPageBase):
         # self.mask_blur_layout.cfg_init()
         self.fill_layout.cfg_init()
         self.inpaint_mask_weight.cfg_init()
-        # self.full_res_padding_layout.cfg_init()
+        self.full_res_padding_layout.cfg_init()
         self.invert_mask.cfg_init()
-        # self.full_res.cfg_init()
+        self.full_res.cfg_init()
 
         self.tips.setVisible(not script.cfg("minimize_ui", bool))
 
@@ -81,17 +81,17 @@ class InpaintPage(SDImgPageBase):
         # self.mask_blur_layout.cfg_connect()
         self.fill_layout.cfg_connect()
         self.inpaint_mask_weight.cfg_connect()
-        # self.full_res_padding_layout.cfg_connect()
+        self.full_res_padding_layout.cfg_connect()
 
         self.invert_mask.cfg_connect()
 
-        # def toggle_fullres(enabled):
-        #     # hide/show fullres padding
-        #     self.full_res_padding_layout.qlabel.setVisible(enabled)
-        #     self.full_res_padding_layout.qspin.setVisible(enabled)
+        def toggle_fullres(enabled):
+            # hide/show fullres padding
+            self.full_res_padding_layout.qlabel.setVisible(enabled)
+            self.full_res_padding_layout.qspin.setVisible(enabled)
 
-        # self.full_res.cfg_connect()
-        # self.full_res.toggled.connect(toggle_fullres)
-        # toggle_fullres(self.full_res.isChecked())
+        self.full_res.cfg_connect()
+        self.full_res.toggled.connect(toggle_fullres)
+        toggle_fullres(self.full_res.isChecked())
 
         self.btn.released.connect(lambda: script.action_inpaint())
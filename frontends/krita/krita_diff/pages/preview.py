@@ -1,7 +1,7 @@
 from krita import QPixmap, QPushButton, QVBoxLayout, QWidget
 
 from ..script import script
-from ..utils import b64_to_img
+from ..utils import bytes_to_img
 from ..widgets import QLabel, StatusBar
 
 
@@ -22,14 +22,24 @@ class PreviewPage(QWidget):
         layout.addWidget(self.preview)
         layout.addStretch()
         self.setLayout(layout)
+        self.preview_id = None
 
     def cfg_init(self):
         pass
 
+    def resizeEvent(self, event):
+        super(PreviewPage, self).resizeEvent(event)
+        # backend downscales the preview to fit the docker
+        script.preview_size = self.width()
+
     def _update_image(self, progress):
         try:
-            enc = progress["current_image"]
-            image = b64_to_img(enc)
+            # preview is only sent when it changed
+            enc = progress["preview"]
+            if enc is None or progress["preview_id"] == self.preview_id:
+                return
+            self.preview_id = progress["preview_id"]
+            image = bytes_to_img(enc)
             self.preview.setPixmap(QPixmap.fromImage(image))
         except:
             pass
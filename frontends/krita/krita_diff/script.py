@@ -24,7 +24,6 @@ from .config import Config
 from .defaults import (
     ADD_MASK_TIMEOUT,
     ERR_NO_DOCUMENT,
-    ETA_REFRESH_INTERVAL,
     EXT_CFG_NAME,
     STATE_INTERRUPT,
     STATE_RESET_DEFAULT,
@@ -32,6 +31,7 @@ from .defaults import (
 )
 from .utils import (
     b64_to_img,
+    bytes_to_img,
     find_optimal_selection_region,
     get_desc_from_resp,
     img_to_ba,
@@ -78,10 +78,9 @@ class Script(QObject):
         self.client = Client(self.cfg, self.ext_cfg)
         self.client.status.connect(self.status_changed.emit)
         self.client.config_updated.connect(self.config_updated.emit)
-        self.eta_timer = QTimer()
-        self.eta_timer.setInterval(ETA_REFRESH_INTERVAL)
-        self.eta_timer.timeout.connect(lambda: self.action_update_eta())
         self.progress_update.connect(lambda p: self.update_status_bar_eta(p))
+        # max width & height of live preview, set by the preview docker
+        self.preview_size = 0
         # keep track of inserted layers to prevent accidental usage as inpaint mask
         self._inserted_layers = []
 
@@ -89,6 +88,8 @@ class Script(QObject):
         """Restore to default config."""
         self.cfg.restore_defaults(not if_empty)
         self.ext_cfg.config.remove("")
+        # lists from the backend were wiped too, so fetch them in full again
+        self.client.config_etag = None
 
         if not if_empty:
             self.status_changed.emit(STATE_RESET_DEFAULT)
@@ -209,7 +210,9 @@ class Script(QObject):
                 parent.addChildNode(layer, None)
             return layer
             
-        def insert(layer_name, enc):
+        def insert(layer_name, enc, offset=None):
+            """Insert image as new layer. If offset is given, the image is only the
+            region of the selection at that offset (see `trim_to_mask`)."""
             nonlocal x, y, width, height, has_selection
             print(f"inserting layer {layer_name}")
             print(f"data size: {len(enc)}")
@@ -218,11 +221,20 @@ class Script(QObject):
             # QImage.Format_RGBA8888 (17) is format used in Krita tutorial
             # both are compatible, & converting from 4 to 17 required a RGB swap
             # Likewise for 5 & 18 (their RGBA counterparts)
-            image = b64_to_img(enc)
+            image = bytes_to_img(enc) if isinstance(enc, bytes) else b64_to_img(enc)
             print(
                 f"image created: {image}, {image.width()}x{image.height()}, depth: {image.depth()}, format: {image.format()}"
             )
 
+            if offset is not None:
+                # write only the trimmed region instead of the whole selection
+                layer = create_layer(layer_name)
+                ox, oy = x + offset[0], y + offset[1]
+                print(f"inserting at x: {ox}, y: {oy}, w: {image.width()}, h: {image.height()}")
+                layer.setPixelData(img_to_ba(image), ox, oy, image.width(), image.height())
+                self._inserted_layers.append(layer)
+                return layer
+
             # NOTE: Scaling must be done by the frontend when using the official API.
             # The scaling here is for SD Upscale, Upscale on a selection region, or inpainting.
             # Image won't be scaled down ONLY if there is no selection; i.e. selecting whole image will scale down,
@@ -291,26 +303,33 @@ class Script(QObject):
         )
         mask_trigger = self.transparency_mask_inserter()
 
+        # when streaming, cb is called once per batch & done is set on the last
+        layers = []
+
         def cb(response):
-            if len(self.client.long_reqs) == 1:  # last request
-                self.eta_timer.stop()
+            is_done = response is None or response.get("done", True)
+            if is_done and len(self.client.long_reqs) == 1:  # last request
+                self.client.unsubscribe_progress()
             assert response is not None, "Backend Error, check terminal"
             #response key varies for official api used for controlnet
             outputs = response["outputs"] if not controlnet_enabled else response["images"]
             glayer_name, layer_names = get_desc_from_resp(response, "txt2img")
-            layers = [
+            new_layers = [
                 insert(name if name else f"txt2img {i + 1}", output)
-                for output, name, i in zip(outputs, layer_names, itertools.count())
+                for output, name, i in zip(outputs, layer_names, itertools.count(len(layers)))
             ]
+            layers.extend(new_layers)
             if self.cfg("hide_layers", bool):
                 for layer in layers[:-1]:
                     layer.setVisible(False)
             if glayer:
                 glayer.setName(glayer_name)
             self.doc.refreshProjection()
-            mask_trigger(layers)
+            # masks flatten layers into new nodes, so only add them once all are in
+            if is_done:
+                mask_trigger(layers)
 
-        self.eta_timer.start(ETA_REFRESH_INTERVAL)
+        self.client.subscribe_progress(self.progress_update.emit, self.preview_size)
 
         if controlnet_enabled:
             sel_image = self.get_selection_image()
@@ -350,10 +369,13 @@ class Script(QObject):
         if self.cfg("save_temp_images", bool):
             save_img(sel_image, path)
 
+        # when streaming, cb is called once per batch & done is set on the last
+        layers = []
+
         def cb(response):
             def cb_upscale(upscale_response):
                 if len(self.client.long_reqs) == 1:  # last request
-                    self.eta_timer.stop()
+                    self.client.unsubscribe_progress()
                 assert response is not None, "Backend Error, check terminal"
 
                 outputs = upscale_response["images"]
@@ -370,8 +392,9 @@ class Script(QObject):
                     glayer.setName(glayer_name)
                 self.doc.refreshProjection()
 
-            if len(self.client.long_reqs) == 1:  # last request
-                self.eta_timer.stop()
+            is_done = response is None or response.get("done", True)
+            if is_done and len(self.client.long_reqs) == 1:  # last request
+                self.client.unsubscribe_progress()
             assert response is not None, "Backend Error, check terminal"
 
             outputs = response["outputs"] if not controlnet_enabled else response["images"]
@@ -389,10 +412,14 @@ class Script(QObject):
 
             layer_name_prefix = "inpaint" if is_inpaint else "img2img"
             glayer_name, layer_names = get_desc_from_resp(response, layer_name_prefix)
-            layers = [
-                insert(name if name else f"{layer_name_prefix} {i + 1}", output)
-                for output, name, i in zip(outputs, layer_names, itertools.count())
+            offsets = response.get("offsets") or [None] * len(outputs)
+            new_layers = [
+                insert(name if name else f"{layer_name_prefix} {i + 1}", output, offset)
+                for output, name, offset, i in zip(
+                    outputs, layer_names, offsets, itertools.count(len(layers))
+                )
             ]
+            layers.extend(new_layers)
             if self.cfg("hide_layers", bool):
                 for layer in layers[:-1]:
                     layer.setVisible(False)
@@ -400,10 +427,11 @@ class Script(QObject):
                 glayer.setName(glayer_name)
             self.doc.refreshProjection()
             # dont need transparency mask for inpaint mode
-            if not is_inpaint:
+            # masks flatten layers into new nodes, so only add them once all are in
+            if not is_inpaint and is_done:
                 mask_trigger(layers)
 
-        self.eta_timer.start()
+        self.client.subscribe_progress(self.progress_update.emit, self.preview_size)
         if controlnet_enabled:
             if is_inpaint:
                 self.client.post_official_api_inpaint(
@@ -627,8 +655,5 @@ class Script(QObject):
 
         self.client.post_interrupt(cb)
 
-    def action_update_eta(self):
-        self.client.get_progress(self.progress_update.emit)
-
 
 script = Script()
\ No newline at end of file
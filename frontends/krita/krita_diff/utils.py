@@ -1,5 +1,7 @@
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from itertools import cycle
 from math import ceil
 
@@ -7,6 +9,9 @@ from krita import Krita, QBuffer, QByteArray, QImage, QIODevice, Qt
 
 from .config import Config
 from .defaults import (
+    RAW_IMAGE_MAGIC,
+    SAVE_QUALITY,
+    SAVE_QUEUE_SIZE,
     TAB_CONFIG,
     TAB_IMG2IMG,
     TAB_INPAINT,
@@ -158,12 +163,28 @@ def find_optimal_selection_region(
     return best_x, best_y, best_width, best_height
 
 
+_save_pool = None
+# held by each queued/running save, so at most SAVE_QUEUE_SIZE are pending
+_save_slots = threading.BoundedSemaphore(SAVE_QUEUE_SIZE)
+
+
 def save_img(img: QImage, path: str):
-    """Expects QImage"""
-    # png is lossless; setting compression to max (0) won't affect quality
+    """Expects QImage. Saves in a background thread so the UI isn't blocked,
+    unless SAVE_QUEUE_SIZE saves are already pending."""
+    global _save_pool
+    if _save_pool is None:
+        _save_pool = ThreadPoolExecutor(1, thread_name_prefix="krita_diff_save")
+    _save_slots.acquire()
+    # QImage is implicitly shared, so copying is cheap & detaches on modification
+    future = _save_pool.submit(write_img, QImage(img), path)
+    future.add_done_callback(lambda _: _save_slots.release())
+
+
+def write_img(img: QImage, path: str):
+    # png is lossless; less compression is faster & won't affect quality
     # NOTE: save_img WILL FAIL when using remote backend
     try:
-        img.save(path, "PNG", 0)
+        img.save(path, "PNG", SAVE_QUALITY)
     except:
         pass
 
@@ -187,12 +208,85 @@ def img_to_b64(img: QImage):
 def b64_to_img(enc: str):
     """Converts base64-encoded string to QImage"""
     ba = QByteArray.fromBase64(enc.encode("utf-8"))
+    if ba.startsWith(RAW_IMAGE_MAGIC):
+        return bytes_to_img(ba.data())
     return QImage.fromData(ba) #Removed explicit format to support other image formats.
 
 
-def bytewise_xor(msg: bytes, key: bytes):
-    """Used for decrypting/encrypting request/response bodies."""
-    return bytes(v ^ k for v, k in zip(msg, cycle(key)))
+def img_to_bytes(img: QImage):
+    """Converts QImage to PNG-encoded bytes"""
+    ba = QByteArray()
+    buffer = QBuffer(ba)
+    buffer.open(QIODevice.WriteOnly)
+    img.save(buffer, "PNG", 0)
+    return ba.data()
+
+
+def bytes_to_img(data: bytes):
+    """Converts encoded bytes to QImage"""
+    if data[: len(RAW_IMAGE_MAGIC)] == RAW_IMAGE_MAGIC:
+        # see `backend.utils.encode_raw()`
+        pos = len(RAW_IMAGE_MAGIC)
+        width = int.from_bytes(data[pos : pos + 4], "big")
+        height = int.from_bytes(data[pos + 4 : pos + 8], "big")
+        image = QImage(data[pos + 8 :], width, height, QImage.Format_RGBA8888)
+        # convert to same format as decoded images; also copies data out of the buffer
+        return image.convertToFormat(QImage.Format_ARGB32)
+    return QImage.fromData(data)
+
+
+def pack_parts(obj: dict):
+    """Copy of `backend.utils.pack_parts()`.
+
+    Bytes values are appended raw after a JSON header instead of being base64-encoded.
+    """
+    meta, sizes, parts = {}, {}, []
+    for k, v in obj.items():
+        if isinstance(v, bytes):
+            sizes[k] = len(v)
+            parts.append(v)
+        elif isinstance(v, list) and v and all(isinstance(x, bytes) for x in v):
+            sizes[k] = [len(x) for x in v]
+            parts.extend(v)
+        else:
+            meta[k] = v
+    head = json.dumps({"meta": meta, "parts": sizes}).encode("utf-8")
+    return b"".join([len(head).to_bytes(4, "big"), head, *parts])
+
+
+def unpack_parts(data: bytes):
+    """Copy of `backend.utils.unpack_parts()`."""
+    size = int.from_bytes(data[:4], "big")
+    head = json.loads(data[4 : 4 + size])
+    obj = head["meta"]
+    pos = 4 + size
+    for k, sizes in head["parts"].items():
+        if isinstance(sizes, list):
+            obj[k] = []
+            for n in sizes:
+                obj[k].append(data[pos : pos + n])
+                pos += n
+        else:
+            obj[k] = data[pos : pos + sizes]
+            pos += sizes
+    return obj
+
+
+def bytewise_xor(msg: bytes, key: bytes, offset: int = 0):
+    """Used for decrypting/encrypting request/response bodies.
+
+    `offset` is the position of `msg` within the whole body, used when the body
+    is processed in chunks. The XOR is done on the whole message at once as
+    big integers, which is far faster than going byte by byte.
+    """
+    size = len(msg)
+    if size == 0:
+        return b""
+    offset %= len(key)
+    key = key[offset:] + key[:offset]
+    stream = (key * (size // len(key) + 1))[:size]
+    res = int.from_bytes(msg, "little") ^ int.from_bytes(stream, "little")
+    return res.to_bytes(size, "little")
 
 
 def get_desc_from_resp(resp: dict, type: str = ""):
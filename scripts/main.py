@@ -4,6 +4,8 @@ from pathlib import Path
 import backend
 import gradio as gr
 from backend.app import app_encryption_middleware
+from backend.metrics import app_timing_middleware
+from backend.script_hack import script_meta, warm_scripts_metadata
 from backend.config import LOGGER_NAME, ROUTE_PREFIX, SCRIPT_ID, SCRIPT_NAME
 from backend.utils import get_encrypt_key
 from fastapi import FastAPI
@@ -41,8 +43,12 @@ def on_app_started(demo: gr.Blocks, app: FastAPI):
     if shared.cmd_opts.api:
         app.include_router(backend.router, prefix=ROUTE_PREFIX, tags=[SCRIPT_NAME])
         app.middleware("http")(app_encryption_middleware)
+        # added last so it is outermost & includes decryption/encryption
+        app.middleware("http")(app_timing_middleware)
         # on first run, this creates a key file
         get_encrypt_key()
+        # so the first /config from Krita doesn't stall on inspecting scripts
+        warm_scripts_metadata()
         if not shared.cmd_opts.listen:
             logger.info(
                 "Add --listen to COMMANDLINE_ARGS to enable usage as a remote backend."
@@ -134,3 +140,5 @@ def on_ui_tabs():
 script_callbacks.on_app_started(on_app_started)
 script_callbacks.on_ui_tabs(on_ui_tabs)
 script_callbacks.on_ui_settings(on_ui_settings)
+# reloaded scripts would be re-inspected anyways, but this drops stale metadata early
+script_callbacks.on_script_unloaded(script_meta.invalidate)
@@ -0,0 +1,85 @@
+"""
+Tests run the backend against the stub `modules` package in `benchmarks/stubs`,
+same as the benchmarks, so neither the webUI nor a GPU is needed. From the repo
+root:
+
+    python -m pytest -q tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "benchmarks", "stubs"), ROOT]
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """The backend reads & writes its config, key & outputs in the working directory."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def app():
+    """Backend mounted the same way `scripts/main.py` does."""
+    from fastapi import FastAPI
+
+    import backend
+    from backend.app import app_encryption_middleware
+    from backend.config import ROUTE_PREFIX
+
+    app = FastAPI()
+    app.include_router(backend.router, prefix=ROUTE_PREFIX)
+    app.middleware("http")(app_encryption_middleware)
+    return app
+
+
+@pytest.fixture
+def post(app):
+    """Post body to a route of the backend straight through ASGI.
+
+    Returns:
+        Callable[[str, bytes], Tuple[int, bytes]]: Takes route & body, returns
+        status & response body.
+    """
+    from backend.config import ROUTE_PREFIX
+
+    def post(route: str, body: bytes, content_type="application/json"):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": ROUTE_PREFIX + route,
+            "raw_path": (ROUTE_PREFIX + route).encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [
+                (b"content-type", content_type.encode()),
+                (b"content-length", str(len(body)).encode()),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": ("127.0.0.1", 80),
+        }
+        pending = [{"type": "http.request", "body": body, "more_body": False}]
+        res = {"status": None, "body": []}
+
+        async def receive():
+            if pending:
+                return pending.pop()
+            return {"type": "http.disconnect"}
+
+        async def send(msg):
+            if msg["type"] == "http.response.start":
+                res["status"] = msg["status"]
+            elif msg["type"] == "http.response.body":
+                res["body"].append(msg.get("body", b""))
+
+        asyncio.run(app(scope, receive, send))
+        return res["status"], b"".join(res["body"])
+
+    return post
@@ -0,0 +1,41 @@
+from PIL import Image, ImageDraw
+
+
+def make_inputs(size: int, mask_box: tuple):
+    """Source image & a mask (in the alpha channel) covering `mask_box`."""
+    image = Image.new("RGBA", (size, size), (128, 128, 128, 255))
+    alpha = Image.new("L", (size, size))
+    ImageDraw.Draw(alpha).rectangle(mask_box, fill=255)
+    mask = Image.new("RGBA", (size, size))
+    mask.putalpha(alpha)
+    return image, mask
+
+
+def test_small_mask_generated_at_model_resolution(monkeypatch):
+    from backend import app, pipeline
+    from backend.structs import DefaultImg2ImgOptions
+
+    sizes = []
+    process_images = pipeline.process_images
+
+    def record(p):
+        sizes.append((p.width, p.height))
+        return process_images(p)
+
+    monkeypatch.setattr(pipeline, "process_images", record)
+
+    image, mask = make_inputs(1024, (500, 500, 507, 507))
+    # what the plugin sends by default, besides only inpainting the masked region
+    req = DefaultImg2ImgOptions(
+        is_inpaint=True,
+        inpaint_full_res=True,
+        inpaint_full_res_padding=16,
+        disable_sddebz_highres=True,
+        base_size=512,
+        max_size=768,
+        trim_to_mask=False,
+    )
+    images, _ = app.run_img2img(req, image, mask)
+
+    assert sizes == [(512, 512)]
+    assert images[0].size == image.size
@@ -0,0 +1,17 @@
+import json
+
+
+def test_unknown_output_format_rejected_before_generating(monkeypatch, post):
+    from backend import pipeline
+    from backend.config import RAW_CONTENT_TYPE
+    from backend.utils import pack_parts
+
+    runs = []
+    monkeypatch.setattr(pipeline, "process_images", runs.append)
+
+    req = {"prompt": "a cat", "output_format": "bogus"}
+    status, _ = post("/txt2img", json.dumps(req).encode("utf-8"))
+    assert status == 422
+    status, _ = post("/raw/txt2img", pack_parts(req), RAW_CONTENT_TYPE)
+    assert status == 422
+    assert runs == []
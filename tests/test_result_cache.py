@@ -0,0 +1,46 @@
+import json
+from base64 import b64encode
+from io import BytesIO
+
+import yaml
+from PIL import Image
+
+
+def test_json_and_raw_routes_share_entry(monkeypatch, post):
+    from backend import pipeline
+    from backend.config import CONFIG_PATH, RAW_CONTENT_TYPE
+    from backend.result_cache import result_cache
+    from backend.utils import pack_parts
+
+    with open(CONFIG_PATH, "w") as f:
+        yaml.safe_dump({"backend": {"result_cache_size": 1024**3}}, f)
+    # index entries of this test's working directory only
+    monkeypatch.setattr(result_cache, "entries", None)
+
+    runs = []
+    process_images = pipeline.process_images
+
+    def record(p):
+        runs.append(p)
+        return process_images(p)
+
+    monkeypatch.setattr(pipeline, "process_images", record)
+
+    image = Image.effect_noise((64, 64), 32).convert("RGB")
+
+    def encode_png(level: int):
+        buf = BytesIO()
+        image.save(buf, format="png", compress_level=level)
+        return buf.getvalue()
+
+    req = {"prompt": "a cat", "seed": 1234, "orig_width": 64, "orig_height": 64}
+    body = {**req, "src_img": b64encode(encode_png(9)).decode("utf-8")}
+    status, res = post("/img2img", json.dumps(body).encode("utf-8"))
+    assert status == 200, res
+    # same pixels encoded differently, over the binary transport
+    body = pack_parts({**req, "src_img": encode_png(1)})
+    status, res = post("/raw/img2img", body, RAW_CONTENT_TYPE)
+    assert status == 200, res
+
+    assert len(runs) == 1
+    assert len(result_cache.entries) == 1